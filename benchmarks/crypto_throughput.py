@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Measure the throughput overhead of OssEncryptedStorage.
+
+The AES-CTR cipher is always measured locally. When the OSS_* environment
+variables of the tests are set, saving and opening a file is also measured
+with OssStorage and OssEncryptedStorage, and a range read of the encrypted
+file.
+
+    $ python benchmarks/crypto_throughput.py --size 64 --rounds 3
+"""
+
+import os
+import sys
+import time
+import argparse
+
+from Crypto.Cipher import AES
+from Crypto.PublicKey import RSA
+from Crypto.Util import Counter
+
+
+def report(label, size, seconds):
+    print("%-32s %8.1f MB/s" % (label, size / seconds / 1024 / 1024))
+
+
+def bench_cipher(data, rounds):
+    key = os.urandom(32)
+    best = None
+    for _ in range(rounds):
+        cipher = AES.new(key, AES.MODE_CTR, counter=Counter.new(128, initial_value=1))
+        start = time.time()
+        for i in range(0, len(data), 64 * 1024):
+            cipher.encrypt(data[i:i + 64 * 1024])
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    report("aes-256-ctr (local)", len(data), best)
+
+
+def bench_storage(label, storage, data, rounds):
+    from django.core.files.base import ContentFile
+
+    name = "benchmarks/crypto-throughput.bin"
+    save = open_ = None
+    try:
+        for _ in range(rounds):
+            start = time.time()
+            storage.save(name, ContentFile(data))
+            elapsed = time.time() - start
+            save = elapsed if save is None else min(save, elapsed)
+
+            start = time.time()
+            storage.open(name).read()
+            elapsed = time.time() - start
+            open_ = elapsed if open_ is None else min(open_, elapsed)
+        report("%s save" % label, len(data), save)
+        report("%s open" % label, len(data), open_)
+
+        start = time.time()
+        storage.read_range(name, len(data) // 2, len(data) // 2 + 1024 * 1024 - 1)
+        print("%-32s %8.1f ms" % ("%s 1MB range read" % label, (time.time() - start) * 1000))
+    finally:
+        storage.delete(name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--size', type=int, default=16, help="Size of the file in MB.")
+    parser.add_argument('--rounds', type=int, default=3, help="Number of rounds, the best one is reported.")
+    args = parser.parse_args()
+
+    data = os.urandom(args.size * 1024 * 1024)
+    bench_cipher(data, args.rounds)
+
+    if not os.environ.get('OSS_ACCESS_KEY_ID'):
+        print("OSS_ACCESS_KEY_ID is not set, skip the storage benchmark")
+        return
+
+    from django.conf import settings
+    key = RSA.generate(2048)
+    settings.configure(
+        MEDIA_URL='/media/',
+        OSS_CRYPTO_PROVIDER='rsa',
+        OSS_CRYPTO_RSA_PRIVATE_KEY=key.exportKey().decode(),
+        OSS_CRYPTO_RSA_PUBLIC_KEY=key.publickey().exportKey().decode(),
+    )
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from django_oss_storage.backends import OssMediaStorage
+    from django_oss_storage.crypto import OssEncryptedMediaStorage
+
+    bench_storage("plain", OssMediaStorage(), data, args.rounds)
+    bench_storage("encrypted", OssEncryptedMediaStorage(), data, args.rounds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Measure the startup cost of django_oss_storage.
+
+Each step runs in a fresh interpreter: importing oss2 alone, importing the
+storage backends, and constructing an OssStorage, which must neither import
+oss2 nor send any request. The modules loaded by each step are reported.
+
+    $ python benchmarks/import_time.py --rounds 5
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SETUP = """
+import sys, time
+from django.conf import settings
+settings.configure(OSS_ACCESS_KEY_ID='id', OSS_ACCESS_KEY_SECRET='secret',
+                   OSS_ENDPOINT='oss-cn-hangzhou.aliyuncs.com', OSS_BUCKET_NAME='bucket')
+before = set(sys.modules)
+start = time.time()
+"""
+
+REPORT = """
+elapsed = time.time() - start
+import json
+print(json.dumps({'seconds': elapsed, 'modules': len(set(sys.modules) - before),
+                  'oss2': 'oss2' in sys.modules, 'requests': 'requests' in sys.modules}))
+"""
+
+STEPS = (
+    ("import oss2", "import oss2"),
+    ("import backends", "import django_oss_storage.backends"),
+    ("construct OssStorage", "from django_oss_storage.backends import OssStorage; OssStorage()"),
+)
+
+
+def run(code):
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    for name in [name for name in env if name.startswith('OSS_')]:
+        del env[name]
+    output = subprocess.check_output([sys.executable, '-c', SETUP + code + REPORT], env=env)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--rounds', type=int, default=5, help="Number of rounds, the best one is reported.")
+    args = parser.parse_args()
+
+    print("%-24s %10s %8s %6s %9s" % ("step", "time", "modules", "oss2", "requests"))
+    for label, code in STEPS:
+        best = None
+        for _ in range(args.rounds):
+            result = run(code)
+            if best is None or result['seconds'] < best['seconds']:
+                best = result
+        print("%-24s %8.1fms %8d %6s %9s" % (label, best['seconds'] * 1000, best['modules'],
+                                              best['oss2'], best['requests']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+
+"""
+Zip and tar archives of OSS files, streamed while the files are downloaded
+concurrently, without staging them in temporary files.
+"""
+
+import os
+import time
+import shutil
+import tarfile
+import zipfile
+import threading
+
+from collections import deque
+from six.moves import queue
+
+from .defaults import logger
+from .throttle import transfer
+
+_DONE = object()
+
+
+class _Stopped(Exception):
+    pass
+
+
+class _Channel(object):
+    """
+    Bounded queue between two threads, whose waits end once stopped is set.
+    """
+
+    def __init__(self, maxsize, stopped):
+        self.queue = queue.Queue(maxsize)
+        self.stopped = stopped
+
+    def put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+        raise _Stopped()
+
+    def get(self):
+        while not self.stopped.is_set():
+            try:
+                return self.queue.get(timeout=0.5)
+            except queue.Empty:
+                pass
+        raise _Stopped()
+
+
+class _Fetch(object):
+    """
+    Download of one file in a thread, into a channel of chunks: first the
+    (size, last modified time) of the file, then its content, then _DONE.
+    """
+
+    def __init__(self, storage, name, chunk_size, max_chunks, stopped, previous):
+        self.storage = storage
+        self.name = name
+        self.chunk_size = chunk_size
+        self.channel = _Channel(max_chunks, stopped)
+        self.started = threading.Event()
+        self._previous = previous
+        self._buffer = b''
+        self._offset = 0
+        self._done = False
+        t = threading.Thread(target=self._run)
+        t.daemon = True
+        t.start()
+
+    def _run(self):
+        try:
+            key = self.storage._get_key_name(self.name)
+            spooled = self.storage._open_pending(key)
+            if spooled is not None:
+                self.started.set()
+                with spooled:
+                    stat = os.fstat(spooled.fileno())
+                    self.channel.put((stat.st_size, int(stat.st_mtime)))
+                    self._copy(spooled)
+                return
+
+            # requests are sent in the order of the archive, so that the file
+            # being archived never waits for the slot of a file after it
+            while self._previous is not None and not self._previous.started.wait(0.5):
+                if self.channel.stopped.is_set():
+                    return
+            self._previous = None
+            limiter = self.storage.limiter
+
+            def get_object():
+                # the slot is released while waiting for the restore of an archived file
+                with transfer(limiter) as progress_callback:
+                    self.started.set()
+                    return self.storage.bucket.get_object(key, progress_callback=progress_callback)
+
+            with self.storage.tracer.span('archive_fetch', key=key) as span:
+                obj = self.storage._read_restored(key, get_object)
+                span.set('request_id', obj.request_id)
+                span.set('bytes', obj.content_length)
+                try:
+                    self.channel.put((obj.content_length, obj.last_modified))
+                    self._copy(obj, limiter)
+                finally:
+                    obj.resp.response.close()
+        except _Stopped:
+            pass
+        except Exception as e:
+            try:
+                self.channel.put(e)
+            except _Stopped:
+                pass
+        finally:
+            self.started.set()
+
+    def _copy(self, source, limiter=None):
+        while True:
+            # a slot is only held while reading, never while waiting for the
+            # channel, whose reader may need a slot too, e.g. to upload parts
+            with transfer(limiter):
+                chunk = source.read(self.chunk_size)
+            if not chunk:
+                break
+            self.channel.put(chunk)
+        self.channel.put(_DONE)
+
+    def _get(self):
+        item = self.channel.get()
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def header(self):
+        return self._get()
+
+    def read(self, size=-1):
+        """
+        Read the content of the file, for shutil.copyfileobj and tarfile.
+        """
+        while not self._done and (size < 0 or len(self._buffer) - self._offset < size):
+            item = self._get()
+            if item is _DONE:
+                self._done = True
+            else:
+                self._buffer = self._buffer[self._offset:] + item
+                self._offset = 0
+        if size < 0:
+            size = len(self._buffer) - self._offset
+        data = self._buffer[self._offset:self._offset + size]
+        self._offset += len(data)
+        return data
+
+
+class _ChannelWriter(object):
+    """
+    Non-seekable file written by zipfile or tarfile, whose writes are passed
+    to the thread iterating over the archive.
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.closed = False
+
+    def write(self, data):
+        if data and not self.closed:
+            self.channel.put(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+class OssArchive(object):
+    """
+    Iterate over the chunks of a zip (ZIP64 when needed) or tar archive of
+    files of the storage, e.g. as the content of a StreamingHttpResponse.
+
+    names are the names of the files, or (name, name in the archive) pairs.
+    Up to workers files are downloaded concurrently, and read_ahead bytes of
+    them are buffered at most, so the memory used doesn't depend on the size
+    of the files. Zip entries are stored by default, since most files are
+    already compressed; compression is a zipfile constant. Zip archives
+    require Python 3.6.
+    """
+
+    formats = ('zip', 'tar')
+
+    def __init__(self, storage, names, format='zip', workers=4, read_ahead=16*1024*1024, chunk_size=64*1024,
+                 compression=zipfile.ZIP_STORED):
+        if format not in self.formats:
+            raise ValueError("Archive format must be one of %s, not '%s'" % (", ".join(self.formats), format))
+        self.storage = storage
+        self.names = names
+        self.format = format
+        self.workers = max(workers, 1)
+        self.chunk_size = chunk_size
+        self.compression = compression
+        # the read ahead is shared by the files being downloaded
+        self.max_chunks = max(read_ahead // (chunk_size * self.workers), 1)
+        self._stopped = threading.Event()
+
+    def _write(self, output):
+        """
+        Write the archive into the output channel, in the archiving thread.
+        """
+        fetches = deque()
+        names = iter(self.names)
+
+        def fetch_ahead():
+            while len(fetches) < self.workers:
+                try:
+                    name = next(names)
+                except StopIteration:
+                    return
+                name, arcname = name if isinstance(name, tuple) else (name, name)
+                previous = fetches[-1][0] if fetches else None
+                fetches.append((_Fetch(self.storage, name, self.chunk_size, self.max_chunks, self._stopped, previous),
+                                arcname))
+
+        target = _ChannelWriter(output)
+        if self.format == 'zip':
+            archive = zipfile.ZipFile(target, 'w', compression=self.compression, allowZip64=True)
+        else:
+            archive = tarfile.open(fileobj=target, mode='w|', format=tarfile.PAX_FORMAT)
+        count = 0
+        try:
+            fetch_ahead()
+            while fetches:
+                fetch, arcname = fetches.popleft()
+                size, last_modified = fetch.header()
+                arcname = arcname.lstrip('/')
+                if self.format == 'zip':
+                    # zip can't store times before 1980
+                    info = zipfile.ZipInfo(arcname, time.localtime(max(last_modified, 315532800))[:6])
+                    info.compress_type = self.compression
+                    info.file_size = size
+                    with archive.open(info, 'w') as dest:
+                        shutil.copyfileobj(fetch, dest, self.chunk_size)
+                else:
+                    info = tarfile.TarInfo(arcname)
+                    info.size = size
+                    info.mtime = last_modified
+                    archive.addfile(info, fetch)
+                count += 1
+                fetch_ahead()
+            archive.close()
+        finally:
+            # nothing is written once the archive is finished or failed, e.g. by the finalizer of zipfile
+            target.closed = True
+        logger().debug("archived %d files", count)
+
+    def __iter__(self):
+        output = _Channel(max(self.max_chunks, 4), self._stopped)
+
+        def run():
+            try:
+                self._write(output)
+                output.put(_DONE)
+            except _Stopped:
+                pass
+            except Exception as e:
+                try:
+                    output.put(e)
+                except _Stopped:
+                    pass
+
+        t = threading.Thread(target=run)
+        t.daemon = True
+        t.start()
+        try:
+            while True:
+                item = output.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Stop the downloads, e.g. when the client disconnected.
+        """
+        self._stopped.set()
@@ -2,7 +2,15 @@
 
 import os
 import six
+import json
+import time
+import random
 import shutil
+import hashlib
+import threading
+
+from collections import OrderedDict
+from six.moves import queue
 
 try:
     from urllib.parse import urljoin
@@ -19,11 +27,14 @@ from django.utils.deconstruct import deconstructible
 from django.utils.timezone import utc
 from tempfile import SpooledTemporaryFile
 
-import oss2.utils
-import oss2.exceptions
-from oss2 import Auth, Service, Bucket, ObjectIterator, BUCKET_ACL_PRIVATE
-
 from .defaults import logger
+from .lazy import LazyModule
+from .lifecycle import ARCHIVED, RESTORING, StorageClassPolicies, get_restore_status, is_archived_error
+from .throttle import get_limiter, transfer
+from .tracing import NOOP_SPAN, OssTracer
+
+# imported on first use, see OssStorage._connect
+oss2 = LazyModule('oss2')
 
 
 def _get_config(name, default=None):
@@ -37,12 +48,66 @@ def _get_config(name, default=None):
         raise ImproperlyConfigured("'%s not found in env variables or setting.py" % name)
 
 
+def _get_bool_config(name, default=False):
+    config = _get_config(name, default=default)
+    if isinstance(config, six.string_types):
+        return config.lower() not in ('', '0', 'false', 'no', 'off')
+    return bool(config)
+
+
+def _get_json_config(name, default=None):
+    # environment variables are JSON, e.g. OSS_TRANSFER_LIMITS='{"default": {"concurrency": 8}}'
+    config = _get_config(name, default=default)
+    if isinstance(config, six.string_types):
+        try:
+            return json.loads(config) if config else default
+        except ValueError:
+            raise ImproperlyConfigured("'%s' is not valid JSON" % name)
+    return config
+
+
 def _normalize_endpoint(endpoint):
     if not endpoint.startswith('http://') and not endpoint.startswith('https://'):
         return 'https://' + endpoint
     else:
         return endpoint
 
+def _run_concurrently(func, items, workers):
+    """
+    Call func on each item with a pool of worker threads, yielding
+    (item, result, exception) tuples as they complete.
+    """
+    tasks = queue.Queue()
+    results = queue.Queue()
+    stopped = threading.Event()
+
+    def worker():
+        while not stopped.is_set():
+            try:
+                item = tasks.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results.put((item, func(item), None))
+            except Exception as e:
+                results.put((item, None, e))
+
+    count = 0
+    for item in items:
+        tasks.put(item)
+        count += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(min(workers, count))]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    try:
+        for _ in range(count):
+            yield results.get()
+    finally:
+        stopped.set()
+
+
 class OssError(Exception):
     def __init__(self, value):
         self.value = value
@@ -50,28 +115,214 @@ class OssError(Exception):
     def __str__(self):
         return repr(self.value)
 
+
+class OssRestoreInProgress(OssError):
+    """
+    The file is archived and its restore is requested or in progress.
+    """
+
 @deconstructible
 class OssStorage(Storage):
     """
     Aliyun OSS Storage
     """
 
-    def __init__(self, access_key_id=None, access_key_secret=None, end_point=None, bucket_name=None, expire_time=None):
+    # whether the CRC64 of the downloaded content matches the one of the object
+    verify_download_crc = True
+    # whether the objects are encrypted on the client side
+    encrypted = False
+
+    def __init__(self, access_key_id=None, access_key_secret=None, end_point=None, bucket_name=None, expire_time=None,
+                 read_endpoints=None, deferred_upload_dir=None):
         self.access_key_id = access_key_id if access_key_id else _get_config('OSS_ACCESS_KEY_ID')
         self.access_key_secret = access_key_secret if access_key_secret else _get_config('OSS_ACCESS_KEY_SECRET')
         self.end_point = _normalize_endpoint(end_point if end_point else _get_config('OSS_ENDPOINT'))
         self.bucket_name = bucket_name if bucket_name else _get_config('OSS_BUCKET_NAME')
         self.expire_time = expire_time if expire_time else int(_get_config('OSS_EXPIRE_TIME', default=60*60*24*30))
 
-        self.auth = Auth(self.access_key_id, self.access_key_secret)
-        self.service = Service(self.auth, self.end_point)
-        self.bucket = Bucket(self.auth, self.end_point, self.bucket_name)
+        self.read_endpoints = read_endpoints
+        # the clients are created on first use, see _connect
+        self._session = None
+        self._connect_timeout = None
+        self._auth = None
+        self._service = None
+        self._bucket = None
+        self._bucket_acl = None
+        self._connect_lock = threading.Lock()
 
-        # try to get bucket acl to check bucket exist or not
-        try:
-            self.bucket_acl = self.bucket.get_bucket_acl().acl
-        except oss2.exceptions.NoSuchBucket:
-            raise SuspiciousOperation("Bucket '%s' does not exist." % self.bucket_name)
+        # shared cache of urls, existence and metadata, see OSS_CACHE_ALIAS
+        cache_alias = _get_config('OSS_CACHE_ALIAS', default='')
+        if cache_alias:
+            from .cache import OssCache
+            # not shared with the plain storages of the bucket, and the plain text
+            # of encrypted files is never cached
+            self.cache = OssCache(cache_alias, self.bucket_name + ('-encrypted' if self.encrypted else ''),
+                                  timeout=int(_get_config('OSS_CACHE_TIMEOUT', default=300)),
+                                  negative_timeout=int(_get_config('OSS_CACHE_NEGATIVE_TIMEOUT', default=30)),
+                                  key_prefix=_get_config('OSS_CACHE_KEY_PREFIX', default='oss'),
+                                  max_content_size=0 if self.encrypted else
+                                  int(_get_config('OSS_CACHE_MAX_CONTENT_SIZE', default=0)))
+        else:
+            self.cache = None
+
+        # upload in the background, see OSS_DEFERRED_UPLOAD_DIR
+        self.deferred_upload_dir = deferred_upload_dir if deferred_upload_dir else _get_config('OSS_DEFERRED_UPLOAD_DIR', default='')
+        self._uploader = None
+
+        # process-wide bandwidth and concurrency limits of the storage class, see OSS_TRANSFER_LIMITS
+        self.limiter = get_limiter(type(self).__name__, _get_json_config('OSS_TRANSFER_LIMITS', default={}))
+
+        # local snapshot of a mostly-static prefix, see OSS_SNAPSHOT_PATH
+        snapshot_path = _get_config('OSS_SNAPSHOT_PATH', default='')
+        if snapshot_path:
+            from .snapshot import OssSnapshot
+            self.snapshot = OssSnapshot(snapshot_path, self._get_dir_key_name(_get_config('OSS_SNAPSHOT_PREFIX', default='')),
+                                        max_age=int(_get_config('OSS_SNAPSHOT_MAX_AGE', default=86400)))
+        else:
+            self.snapshot = None
+
+        # storage classes of the uploads under key prefixes, see OSS_STORAGE_CLASS_POLICIES
+        self.storage_class_policies = StorageClassPolicies(_get_json_config('OSS_STORAGE_CLASS_POLICIES', default={}))
+        # seconds to wait for the restore of an archived file when reading it, see OSS_RESTORE_WAIT
+        self.restore_wait = int(_get_config('OSS_RESTORE_WAIT', default=0))
+
+        # sampled spans of the operations, see OSS_TRACE_SAMPLE_RATE
+        self.tracer = OssTracer(float(_get_config('OSS_TRACE_SAMPLE_RATE', default=0)))
+
+        # end to end CRC64 checks of the transfers, see OSS_VERIFY_CRC
+        self.verify_crc = _get_bool_config('OSS_VERIFY_CRC')
+
+        # next append position of the objects appended by this process
+        self._append_positions = OrderedDict()
+        self._append_positions_size = int(_get_config('OSS_APPEND_POSITION_CACHE_SIZE', default=1024))
+        self._append_retries = int(_get_config('OSS_APPEND_RETRIES', default=3))
+        self._append_lock = threading.Lock()
+
+        # open connections in the background, see OSS_CONNECTION_WARMUP
+        connections = int(_get_config('OSS_CONNECTION_WARMUP', default=0))
+        if connections:
+            t = threading.Thread(target=self.warm_up, args=(connections,))
+            t.daemon = True
+            t.start()
+
+    def _connect(self):
+        """
+        Create the session, the clients and the bucket on first use, so that
+        constructing the storage neither imports oss2 nor sends any request.
+        """
+        with self._connect_lock:
+            if self._bucket is not None:
+                return
+            from .routing import OssRoutingBucket
+            from .session import get_session
+
+            # connection pool shared by all the buckets of the process
+            tcp_keepalive = None
+            if _get_bool_config('OSS_TCP_KEEPALIVE', default=True):
+                tcp_keepalive = (int(_get_config('OSS_TCP_KEEPALIVE_IDLE', default=60)),
+                                 int(_get_config('OSS_TCP_KEEPALIVE_INTERVAL', default=10)),
+                                 int(_get_config('OSS_TCP_KEEPALIVE_COUNT', default=6)))
+            self._session = get_session(int(_get_config('OSS_CONNECTION_POOL_SIZE', default=oss2.defaults.connection_pool_size)),
+                                        pool_block=_get_bool_config('OSS_CONNECTION_POOL_BLOCK', default=False),
+                                        tcp_keepalive=tcp_keepalive)
+            self._connect_timeout = int(_get_config('OSS_CONNECT_TIMEOUT', default=oss2.defaults.connect_timeout))
+
+            self._auth = oss2.Auth(self.access_key_id, self.access_key_secret)
+            self._service = oss2.Service(self._auth, self.end_point, session=self._session,
+                                         connect_timeout=self._connect_timeout)
+            bucket = self._create_bucket(self.end_point, self.bucket_name)
+
+            # try to get bucket acl to check bucket exist or not
+            try:
+                self._bucket_acl = bucket.get_bucket_acl().acl
+            except oss2.exceptions.NoSuchBucket:
+                raise SuspiciousOperation("Bucket '%s' does not exist." % self.bucket_name)
+
+            # route reads between the primary and the replica endpoints, see OSS_READ_ENDPOINTS
+            read_endpoints = self.read_endpoints if self.read_endpoints else _get_config('OSS_READ_ENDPOINTS', default=[])
+            if isinstance(read_endpoints, six.string_types):
+                read_endpoints = [endpoint for endpoint in read_endpoints.split(',') if endpoint.strip()]
+            if read_endpoints:
+                replicas = []
+                for endpoint in read_endpoints:
+                    # an endpoint of the same bucket, or a (endpoint, bucket name) pair of a replica
+                    if isinstance(endpoint, six.string_types):
+                        endpoint = (endpoint, self.bucket_name)
+                    replicas.append(self._create_bucket(_normalize_endpoint(endpoint[0].strip()), endpoint[1]))
+                bucket = OssRoutingBucket(bucket, replicas,
+                                          max_error_rate=float(_get_config('OSS_READ_MAX_ERROR_RATE', default=0.5)),
+                                          cooldown=int(_get_config('OSS_READ_FAILOVER_COOLDOWN', default=30)))
+            self._bucket = bucket
+            logger().debug("connected to bucket: %s, endpoint: %s", self.bucket_name, self.end_point)
+
+    def _connected(name):
+        def getter(self):
+            if getattr(self, name) is None:
+                self._connect()
+            return getattr(self, name)
+        return property(getter)
+
+    session = _connected('_session')
+    connect_timeout = _connected('_connect_timeout')
+    auth = _connected('_auth')
+    service = _connected('_service')
+    bucket = _connected('_bucket')
+    bucket_acl = _connected('_bucket_acl')
+    del _connected
+
+    @property
+    def uploader(self):
+        """
+        The deferred uploader, created on first use, which also uploads the
+        files left pending by a previous process.
+        """
+        if self._uploader is None and self.deferred_upload_dir:
+            from .deferred import get_uploader
+            self._uploader = get_uploader(self.bucket, self.deferred_upload_dir,
+                                          workers=int(_get_config('OSS_DEFERRED_UPLOAD_WORKERS', default=4)),
+                                          max_pending=int(_get_config('OSS_DEFERRED_UPLOAD_MAX_PENDING', default=1000)),
+                                          retries=int(_get_config('OSS_DEFERRED_UPLOAD_RETRIES', default=5)))
+        return self._uploader
+
+    def _create_bucket(self, end_point, bucket_name):
+        return oss2.Bucket(self.auth, end_point, bucket_name, session=self.session, connect_timeout=self.connect_timeout)
+
+    def warm_up(self, connections=None):
+        """
+        Open connections to OSS ahead of the requests, e.g. in the post_fork
+        hook of gunicorn, so that they don't pay the TCP and TLS handshakes.
+        """
+        connections = connections if connections else int(_get_config('OSS_CONNECTION_WARMUP', default=4))
+        bucket = getattr(self.bucket, 'primary', self.bucket)
+        # concurrent requests, so that each one opens its own connection
+        for _, _, error in _run_concurrently(lambda _: bucket.get_bucket_acl(), range(connections), connections):
+            if error is not None:
+                logger().warning("failed to warm up the connection pool: %s", error)
+        logger().debug("connection pool warmed up: %s", self.session.pool_stats())
+
+    def pool_stats(self):
+        """
+        Get the hits, misses and idle connections of the connection pool of
+        each host, to size OSS_CONNECTION_POOL_SIZE.
+        """
+        return self.session.pool_stats()
+
+    def transfer_stats(self):
+        """
+        Get the throughput, active and waiting transfers of the limiter of the
+        storage class, or None if its transfers are not limited.
+        """
+        return self.limiter.stats() if self.limiter is not None else None
+
+    def routing_stats(self):
+        """
+        Get the latency, error rate and health of each read endpoint, in
+        routing order, or None if reads are not routed.
+        """
+        from .routing import OssRoutingBucket
+        if isinstance(self.bucket, OssRoutingBucket):
+            return self.bucket.stats()
+        return None
 
     def _get_key_name(self, name):
         """
@@ -96,44 +347,345 @@ class OssStorage(Storage):
         # Store filenames with forward slashes, even on Windows.
         return name.replace('\\', '/')
 
+    def _get_dir_key_name(self, name):
+        """
+        Get the key prefix of a directory, with a trailing slash unless it is
+        the bucket root.
+        """
+        if name == ".":
+            name = ""
+        prefix = self._get_key_name(name)
+        if prefix == ".":
+            return ""
+        if not prefix.endswith('/'):
+            prefix += "/"
+        return prefix
+
     def _open(self, name, mode='rb'):
         logger().debug("name: %s, mode: %s", name, mode)
+        if mode == "wb":
+            return self._open_write(name)
+        if mode == "ab":
+            return self._open_append(name)
         if mode != "rb":
-            raise ValueError("OSS files can only be opened in read-only mode")
+            raise ValueError("OSS files can only be opened in 'rb', 'wb' or 'ab' mode")
 
         target_name = self._get_key_name(name)
         logger().debug("target name: %s", target_name)
+        with self.tracer.span('open', key=target_name) as span:
+            spooled = self._open_pending(target_name)
+            if spooled is not None:
+                span.set('cache', 'pending')
+                return OssFile(spooled, target_name, self)
+            try:
+                return OssFile(self._download(target_name, span), target_name, self)
+            except oss2.exceptions.NoSuchKey:
+                raise OssError("%s does not exist" % name)
+            except OssError:
+                raise
+            except:
+                raise OssError("Failed to open %s" % name)
+
+    def _open_pending(self, target_name):
+        """
+        Open the spooled file of a pending deferred upload, or return None.
+        """
+        path = self.uploader.pending_path(target_name) if self.uploader is not None else None
+        if path is None:
+            return None
         try:
-            # Load the key into a temporary file
-            tmpf = SpooledTemporaryFile(max_size=10*1024*1024)  # 10MB
-            obj = self.bucket.get_object(target_name)
-            logger().info("content length: %d, requestid: %s", obj.content_length, obj.request_id)
-            if obj.content_length is None:
-                shutil.copyfileobj(obj, tmpf)
-            else:
-                oss2.utils.copyfileobj_and_verify(obj, tmpf, obj.content_length, request_id=obj.request_id)
+            return open(path, 'rb')
+        except (IOError, OSError):
+            # uploaded in the meantime
+            return None
+
+    def _download(self, target_name, span=NOOP_SPAN):
+        """
+        Load the key into a temporary file, or from the shared cache for small files.
+        """
+        cache_content = self.cache is not None and self.cache.max_content_size > 0
+        if cache_content:
+            generation, content = self.cache.get_content(target_name)
+            span.set('cache', 'hit' if content is not None else 'miss')
+            if content is not None:
+                span.set('bytes', len(content))
+                return six.BytesIO(content)
+
+        tmpf = SpooledTemporaryFile(max_size=10*1024*1024)  # 10MB
+
+        def download():
+            with transfer(self.limiter) as progress_callback:
+                obj = self.bucket.get_object(target_name, progress_callback=progress_callback)
+                logger().info("content length: %d, requestid: %s", obj.content_length, obj.request_id)
+                span.set('request_id', obj.request_id)
+                span.set('bytes', obj.content_length)
+                if obj.content_length is None:
+                    shutil.copyfileobj(obj, tmpf)
+                else:
+                    oss2.utils.copyfileobj_and_verify(obj, tmpf, obj.content_length, request_id=obj.request_id)
+            return obj
+
+        obj = self._read_restored(target_name, download)
+        if self.verify_download_crc and self.verify_crc:
+            # computed while streaming by oss2, compared with x-oss-hash-crc64ecma
+            oss2.utils.check_crc('get object', obj.client_crc, obj.server_crc, obj.request_id)
+        tmpf.seek(0)
+
+        if cache_content and obj.content_length is not None and obj.content_length <= self.cache.max_content_size:
+            self.cache.set_content(target_name, generation, tmpf.read())
             tmpf.seek(0)
-            return OssFile(tmpf, target_name, self)
-        except oss2.exceptions.NoSuchKey:
-            raise OssError("%s does not exist" % name)
-        except:
-            raise OssError("Failed to open %s" % name)
+        return tmpf
+
+    def read_range(self, name, start, end=None):
+        """
+        Read the bytes from start to end (inclusive, or to the end of the file
+        if None) without downloading the whole file.
+        """
+        target_name = self._get_key_name(name)
+        logger().debug("target name: %s, range: %s-%s", target_name, start, end)
+        with self.tracer.span('read_range', key=target_name) as span:
+            def read():
+                with transfer(self.limiter) as progress_callback:
+                    obj = self.bucket.get_object(target_name, byte_range=(start, end),
+                                                 progress_callback=progress_callback)
+                    return obj, obj.read()
+
+            try:
+                obj, data = self._read_restored(target_name, read)
+            except oss2.exceptions.NoSuchKey:
+                raise OssError("%s does not exist" % name)
+            span.set('request_id', obj.request_id)
+            span.set('bytes', len(data))
+            return data
+
+    def _read_restored(self, key, read):
+        """
+        Call read(), which gets the object of the key. If the object is
+        archived, request its restore, and wait up to OSS_RESTORE_WAIT seconds
+        for it before calling read() again, or raise OssRestoreInProgress.
+        """
+        try:
+            return read()
+        except oss2.exceptions.ServerError as e:
+            if not is_archived_error(e):
+                raise
+        self._request_restore(key)
+        if not self.restore_wait:
+            raise OssRestoreInProgress("%s is archived, its restore is in progress" % key)
+        self._wait_for_restore(key, self.restore_wait)
+        return read()
+
+    def _request_restore(self, key):
+        try:
+            self.bucket.restore_object(key)
+            logger().info("restore of %s requested", key)
+        except oss2.exceptions.RestoreAlreadyInProgress:
+            pass
+
+    def _restore_status(self, key):
+        # the restore is requested on the primary endpoint, not on the replicas
+        primary = getattr(self.bucket, 'primary', self.bucket)
+        return get_restore_status(primary.head_object(key).headers)
+
+    def _wait_for_restore(self, key, timeout):
+        """
+        Poll the restore status of the key until it is readable, and return it,
+        or raise OssRestoreInProgress after timeout seconds.
+        """
+        interval = int(_get_config('OSS_RESTORE_POLL_INTERVAL', default=10))
+        deadline = time.time() + timeout
+        while True:
+            status = self._restore_status(key)
+            if status.state not in (ARCHIVED, RESTORING):
+                return status
+            now = time.time()
+            if now >= deadline:
+                raise OssRestoreInProgress("%s is still being restored after %ds" % (key, timeout))
+            # the last poll is at the deadline
+            time.sleep(min(interval, deadline - now))
+
+    def restore_status(self, name):
+        """
+        Get the OssRestoreStatus of the file: its storage class, whether it is
+        readable, archived, being restored or restored, and when a restored
+        file is archived again.
+        """
+        return self._restore_status(self._get_key_name(name))
+
+    def restore(self, names, wait=0, workers=None):
+        """
+        Concurrently request the restore of the archived files, e.g. before a
+        batch job reads them, waiting up to wait seconds for each one.
+
+        Returns a dict of the names to their OssRestoreStatus, and a dict of
+        the names which failed to the exception raised.
+        """
+        def restore_one(name):
+            key = self._get_key_name(name)
+            with self.tracer.span('restore', key=key) as span:
+                status = self._restore_status(key)
+                span.set('storage_class', status.storage_class)
+                if status.state == ARCHIVED:
+                    self._request_restore(key)
+                    status = status._replace(state=RESTORING)
+                if wait and status.state == RESTORING:
+                    status = self._wait_for_restore(key, wait)
+                span.set('state', status.state)
+                return status
+
+        workers = workers if workers else int(_get_config('OSS_RESTORE_WORKERS', default=16))
+        statuses = {}
+        failures = {}
+        for name, status, error in _run_concurrently(self.tracer.wrap(restore_one), names, workers):
+            if error is not None:
+                logger().warning("failed to restore %s: %s", name, error)
+                failures[name] = error
+            else:
+                statuses[name] = status
+        return statuses, failures
+
+    def _open_write(self, name):
+        target_name = self._get_key_name(name)
+        part_size = int(_get_config('OSS_PART_SIZE', default=10*1024*1024))  # 10MB
+        logger().debug("target name: %s, part size: %d", target_name, part_size)
+        writer = OssMultipartWriter(self.bucket, target_name, part_size,
+                                    headers=self.storage_class_policies.headers(target_name),
+                                    limiter=self.limiter, verify_crc=self.verify_crc,
+                                    tracer=self.tracer)
+        return OssWriteFile(writer, name, self)
+
+    def _open_append(self, name):
+        buffer_size = int(_get_config('OSS_PART_SIZE', default=10*1024*1024))  # 10MB
+        return OssWriteFile(OssAppendWriter(self, name, buffer_size), name, self)
 
     def _save(self, name, content):
         target_name = self._get_key_name(name)
         logger().debug("target name: %s", target_name)
         logger().debug("content: %s", content)
-        self.bucket.put_object(target_name, content)
+        self._forget_append_position(target_name)
+        headers = self.storage_class_policies.headers(target_name)
+        with self.tracer.span('save', key=target_name, bytes=getattr(content, 'size', None)) as span:
+            if self.uploader is not None:
+                span.set('deferred', True)
+                self.uploader.enqueue(target_name, content, on_uploaded=self._invalidate, limiter=self.limiter,
+                                      headers=headers, tracer=self.tracer)
+            else:
+                with transfer(self.limiter) as progress_callback:
+                    result = self.bucket.put_object(target_name, content, headers=headers,
+                                                    progress_callback=progress_callback)
+                span.set('request_id', result.request_id)
+        self._invalidate(target_name, getattr(content, 'size', None))
         return os.path.normpath(name)
 
+    def _invalidate(self, target_name, size=None, deleted=False):
+        if self.cache is not None:
+            self.cache.invalidate(target_name)
+        if self.snapshot is not None and self.snapshot.covers(target_name):
+            if deleted:
+                self.snapshot.record_delete(target_name)
+            else:
+                self.snapshot.record_write(target_name, size)
+
+    def _get_append_position(self, target_name):
+        """
+        Get the next append position and the CRC64 of the object so far, None
+        if unknown.
+        """
+        with self._append_lock:
+            return self._append_positions.get(target_name, (0, 0))
+
+    def _set_append_position(self, target_name, position, crc=None):
+        with self._append_lock:
+            self._append_positions.pop(target_name, None)
+            self._append_positions[target_name] = (position, crc)
+            while len(self._append_positions) > self._append_positions_size:
+                self._append_positions.popitem(last=False)
+
+    def _forget_append_position(self, target_name):
+        with self._append_lock:
+            self._append_positions.pop(target_name, None)
+
+    def append(self, name, content):
+        """
+        Append content (bytes or a file-like object) to an appendable object,
+        creating it if it doesn't exist, and return the next append position.
+
+        The next position is cached, so no HEAD request is needed per append.
+        If it is stale, e.g. the object was appended by another process, the
+        append is retried at the position returned by OSS. With OSS_VERIFY_CRC,
+        the CRC64 of the whole object is checked after each append when the
+        CRC64 of the previous content is known.
+        """
+        target_name = self._get_key_name(name)
+        if hasattr(content, 'read'):
+            start = content.tell() if hasattr(content, 'seek') else None
+        else:
+            content = force_bytes(content)
+            start = None
+        retries = self._append_retries
+        headers = self.storage_class_policies.headers(target_name)
+        position, crc = self._get_append_position(target_name)
+        with self.tracer.span('append', key=target_name) as span:
+            for attempt in range(retries + 1):
+                span.set('retries', attempt)
+                try:
+                    with transfer(self.limiter) as progress_callback:
+                        # the storage class is set when the object is created
+                        result = self.bucket.append_object(target_name, position, content, progress_callback=progress_callback,
+                                                           init_crc=crc if self.verify_crc else None,
+                                                           headers=headers if position == 0 else None)
+                    break
+                except oss2.exceptions.PositionNotEqualToLength as e:
+                    if attempt == retries or (hasattr(content, 'read') and start is None):
+                        self._forget_append_position(target_name)
+                        raise
+                    logger().debug("append position of %s is %d, not %d, retry", target_name, e.next_position, position)
+                    position = e.next_position
+                    crc = None
+                    if start is not None:
+                        content.seek(start)
+                except oss2.exceptions.ObjectNotAppendable:
+                    self._forget_append_position(target_name)
+                    raise OssError("%s is not an appendable object" % name)
+            span.set('request_id', result.request_id)
+            span.set('bytes', result.next_position - position)
+
+        logger().debug("appended %s at %d, next position: %d", target_name, position, result.next_position)
+        self._set_append_position(target_name, result.next_position, result.crc)
+        self._invalidate(target_name)
+        return result.next_position
+
     def create_dir(self, dirname):
         target_name = self._get_key_name(dirname)
         if not target_name.endswith('/'):
             target_name += '/'
 
-        self.bucket.put_object(target_name, '')
+        with self.tracer.span('create_dir', key=target_name) as span:
+            span.set('request_id', self.bucket.put_object(target_name, '').request_id)
+        self._invalidate(target_name)
 
     def exists(self, name):
+        target_name = self._get_key_name(name)
+        with self.tracer.span('exists', key=target_name) as span:
+            if self.uploader is not None and self.uploader.pending_path(target_name) is not None:
+                span.set('cache', 'pending')
+                return True
+            if self.snapshot is not None and self.snapshot.usable(target_name):
+                span.set('cache', 'snapshot')
+                if name.endswith("/"):
+                    return self.snapshot.is_dir(target_name)
+                return self.snapshot.lookup(target_name) is not None or self.snapshot.is_dir(target_name + "/")
+            if self.cache is None:
+                return self._exists(name)
+
+            generation, exist = self.cache.get_exists(target_name)
+            span.set('cache', 'hit' if exist is not None else 'miss')
+            if exist is None:
+                exist = self._exists(name)
+                self.cache.set_exists(target_name, generation, exist)
+            return exist
+
+    def _exists(self, name):
         target_name = self._get_key_name(name)
         logger().debug("name: %s, target name: %s", name, target_name)
         if name.endswith("/"):
@@ -152,37 +704,77 @@ class OssStorage(Storage):
             # It's not a file, but it might be a directory. Check again that it's not a directory.
             name2 = name + "/"
             logger().debug("to check %s", name2)
-            return self.exists(name2)
+            return self._exists(name2)
 
         return exist
 
     def get_file_meta(self, name):
+        """
+        Get the OssFileMeta (content_length, last_modified, etag) of the file,
+        from the snapshot, the shared cache or a HEAD request.
+        """
         name = self._get_key_name(name)
-        return self.bucket.get_object_meta(name)
+        with self.tracer.span('get_file_meta', key=name) as span:
+            if self.snapshot is not None and self.snapshot.usable(name):
+                file_meta = self.snapshot.lookup(name)
+                if file_meta is not None and file_meta.content_length is not None:
+                    span.set('cache', 'snapshot')
+                    return file_meta
+            if self.cache is None:
+                return self._get_object_meta(name, span)
+
+            generation, file_meta = self.cache.get_meta(name)
+            span.set('cache', 'hit' if file_meta is not None else 'miss')
+            if file_meta is None:
+                file_meta = self._get_object_meta(name, span)
+                self.cache.set_meta(name, generation, file_meta)
+            return file_meta
+
+    def _get_object_meta(self, key, span):
+        from .cache import OssFileMeta
+        result = self.bucket.get_object_meta(key)
+        span.set('request_id', result.request_id)
+        # the same record as the one of the cache and of the snapshot
+        return OssFileMeta(result.content_length, result.last_modified, result.etag)
 
     def size(self, name):
+        path = self.uploader.pending_path(self._get_key_name(name)) if self.uploader is not None else None
+        if path is not None:
+            try:
+                return os.path.getsize(path)
+            except OSError:
+                # uploaded in the meantime
+                pass
         file_meta = self.get_file_meta(name)
         return file_meta.content_length
 
-    def modified_time(self, name):
+    def _last_modified(self, name):
         file_meta = self.get_file_meta(name)
-        return datetime.fromtimestamp(file_meta.last_modified)
+        if file_meta.last_modified is None:
+            # e.g. in a snapshot loaded from an inventory without LastModifiedDate
+            file_meta = self._get_object_meta(self._get_key_name(name), NOOP_SPAN)
+        return file_meta.last_modified
+
+    def modified_time(self, name):
+        return datetime.fromtimestamp(self._last_modified(name))
 
     created_time = accessed_time = modified_time
 
     def get_modified_time(self, name):
-        file_meta = self.get_file_meta(name)
+        last_modified = self._last_modified(name)
 
         if settings.USE_TZ:
-            return datetime.utcfromtimestamp(file_meta.last_modified).replace(tzinfo=utc)
+            return datetime.utcfromtimestamp(last_modified).replace(tzinfo=utc)
         else:
-            return datetime.fromtimestamp(file_meta.last_modified)
+            return datetime.fromtimestamp(last_modified)
 
     get_created_time = get_accessed_time = get_modified_time
 
     def content_type(self, name):
         name = self._get_key_name(name)
-        file_info = self.bucket.head_object(name)
+        with self.tracer.span('content_type', key=name) as span:
+            file_info = self.bucket.head_object(name)
+            span.set('request_id', file_info.request_id)
         return file_info.content_type
 
     def listdir(self, name):
@@ -193,39 +785,289 @@ class OssStorage(Storage):
             name += "/"
         logger().debug("name: %s", name)
 
-        files = []
-        dirs = []
+        with self.tracer.span('listdir', key=name) as span:
+            if self.snapshot is not None and self.snapshot.usable(name):
+                span.set('cache', 'snapshot')
+                return self.snapshot.listdir(name)
 
-        for obj in ObjectIterator(self.bucket, prefix=name, delimiter='/'):
-            if obj.is_prefix():
-                dirs.append(obj.key)
-            else:
-                files.append(obj.key)
+            files = []
+            dirs = []
+
+            for obj in oss2.ObjectIterator(self.bucket, prefix=name, delimiter='/'):
+                if obj.is_prefix():
+                    dirs.append(obj.key)
+                else:
+                    files.append(obj.key)
 
         logger().debug("dirs: %s", list(dirs))
         logger().debug("files: %s", files)
         return dirs, files
 
+    def _list_prefix(self, prefix):
+        """
+        List one directory level under the key prefix, returning the sub-prefixes
+        and the object infos (key, size, last_modified, etag) of the files.
+        """
+        dirs = []
+        files = []
+        for obj in oss2.ObjectIterator(self.bucket, prefix=prefix, delimiter='/'):
+            if obj.is_prefix():
+                dirs.append(obj.key)
+            elif obj.key != prefix:
+                # skip the placeholder object created by create_dir
+                files.append(obj)
+        return dirs, files
+
+    def walk(self, top="", workers=None):
+        """
+        Walk the directory tree under top, listing sub-prefixes concurrently.
+
+        Yields (dirpath, dirs, files) as soon as each level is listed, where dirs
+        are the sub-prefixes and files the object infos returned by the listing.
+        The order between directories is not deterministic.
+        """
+        return self._walk_keys(self._get_dir_key_name(top), workers)
+
+    def _walk_keys(self, prefix, workers=None):
+        workers = workers if workers else int(_get_config('OSS_WALK_WORKERS', default=8))
+        logger().debug("walk prefix: %s, workers: %d", prefix, workers)
+
+        tasks = queue.Queue()
+        results = queue.Queue()
+        stopped = threading.Event()
+
+        def worker():
+            while True:
+                task = tasks.get()
+                if task is None or stopped.is_set():
+                    return
+                try:
+                    with self.tracer.span('walk', key=task) as span:
+                        dirs, files = self._list_prefix(task)
+                        span.set('dirs', len(dirs))
+                        span.set('files', len(files))
+                    results.put((task, (dirs, files), None))
+                except Exception as e:
+                    results.put((task, None, e))
+
+        # the listings are children of the current span, e.g. of du
+        worker = self.tracer.wrap(worker)
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        tasks.put(prefix)
+        pending = 1
+        try:
+            while pending:
+                dirpath, listing, error = results.get()
+                pending -= 1
+                if error is not None:
+                    raise error
+                dirs, files = listing
+                for d in dirs:
+                    tasks.put(d)
+                    pending += 1
+                yield dirpath, dirs, files
+        finally:
+            stopped.set()
+            for _ in threads:
+                tasks.put(None)
+
+    def du(self, top="", workers=None):
+        """
+        Return the (total size, object count) under top, aggregated from the
+        listing data only, without any HEAD requests.
+        """
+        size = 0
+        count = 0
+        with self.tracer.span('du', key=self._get_dir_key_name(top)) as span:
+            for _, _, files in self.walk(top, workers=workers):
+                for obj in files:
+                    size += obj.size
+                    count += 1
+            span.set('bytes', size)
+            span.set('files', count)
+        logger().debug("du %s: size: %d, count: %d", top, size, count)
+        return size, count
+
     def url(self, name):
         key = self._get_key_name(name)
+        with self.tracer.span('url', key=key) as span:
+            return self._url(key, span)
+
+    def _url(self, key, span):
+        if self.cache is not None:
+            generation, str = self.cache.get_url(key)
+            span.set('cache', 'hit' if str is not None else 'miss')
+            if str is not None:
+                return str
+
         str = self.bucket.sign_url('GET', key, expires=self.expire_time)
-        if self.bucket_acl != BUCKET_ACL_PRIVATE :
+        if self.bucket_acl != oss2.BUCKET_ACL_PRIVATE :
             idx = str.find('?')
             if idx > 0: 
                 str = str[:idx].replace('%2F', '/')
+            if self.cache is not None:
+                self.cache.set_url(key, generation, str)
+        elif self.cache is not None:
+            # signed urls are shared for half of their lifetime at most
+            self.cache.set_url(key, generation, str, timeout=min(self.cache.timeout, self.expire_time // 2))
         return str
 
+    def verify(self, local_root, prefix="", spot_checks=0, spot_size=64*1024, workers=None):
+        """
+        Check the files under the local directory against the objects under
+        prefix, concurrently, and return the (relative path, problem) of the
+        mismatches.
+
+        Sizes come from the listing. The content is compared with the MD5 of
+        the ETag of objects uploaded by a single PUT, and else with the CRC64
+        of the object. spot_checks random ranges of spot_size bytes of each
+        file are also compared with the bytes in OSS.
+
+        The ETag and CRC64 of encrypted objects are the ones of the encrypted
+        content, so encrypted storages only compare the decrypted spot checks.
+        """
+        if self.encrypted and not spot_checks:
+            raise ValueError("Encrypted OSS files can only be verified with spot checks")
+        prefix = self._get_dir_key_name(prefix)
+        remote = {}
+        for _, _, files in self._walk_keys(prefix, workers):
+            for obj in files:
+                remote[obj.key[len(prefix):]] = obj
+
+        local = {}
+        for dirpath, _, filenames in os.walk(local_root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                local[os.path.relpath(path, local_root).replace(os.sep, '/')] = path
+
+        problems = []
+        for name in sorted(set(local) - set(remote)):
+            problems.append((name, "missing in OSS"))
+        for name in sorted(set(remote) - set(local)):
+            problems.append((name, "missing locally"))
+
+        def check(name):
+            path, obj = local[name], remote[name]
+            size = os.path.getsize(path)
+            if size != obj.size:
+                return "size differs: %d locally, %d in OSS" % (size, obj.size)
+
+            etag = obj.etag.strip('"').upper()
+            use_md5 = obj.type == 'Normal' and len(etag) == 32 and '-' not in etag
+            local_hash = hashlib.md5() if use_md5 else oss2.utils.Crc64(0)
+            with open(path, 'rb') as f:
+                if not self.encrypted:
+                    for chunk in iter(lambda: f.read(1024*1024), b''):
+                        local_hash.update(chunk)
+                    if use_md5:
+                        if local_hash.hexdigest().upper() != etag:
+                            return "md5 differs"
+                    else:
+                        server_crc = self.bucket.head_object(obj.key).server_crc
+                        if server_crc is not None and local_hash.crc != server_crc:
+                            return "crc64 differs"
+
+                for _ in range(spot_checks if size else 0):
+                    start = random.randint(0, max(size - spot_size, 0))
+                    end = min(start + spot_size, size) - 1
+                    f.seek(start)
+                    if f.read(end - start + 1) != self.bucket.get_object(obj.key, byte_range=(start, end)).read():
+                        return "content differs in bytes %d-%d" % (start, end)
+            return None
+
+        workers = workers if workers else int(_get_config('OSS_VERIFY_WORKERS', default=8))
+        for name, problem, error in _run_concurrently(check, sorted(set(local) & set(remote)), workers):
+            if error is not None:
+                problem = "failed to verify: %s" % error
+            if problem is not None:
+                logger().warning("verify %s: %s", name, problem)
+                problems.append((name, problem))
+        return sorted(problems)
+
+    def prefetch(self, names, what=('meta', 'url', 'content'), workers=None):
+        """
+        Concurrently fill the caches of the storage for the given names, so
+        that the first requests don't look them up in OSS.
+
+        what selects the answers to prefetch: 'meta' (get_file_meta and size),
+        'exists', 'url' and 'content'. Content is only prefetched for files up
+        to OSS_CACHE_MAX_CONTENT_SIZE. Returns a dict of the names which failed
+        to the exception raised. Raises ValueError without a shared cache.
+        """
+        what = set(what)
+        unknown = what - set(['meta', 'exists', 'url', 'content'])
+        if unknown:
+            raise ValueError("Unknown prefetch kinds: %s" % ", ".join(sorted(unknown)))
+        if self.cache is None:
+            # the answers would be looked up in OSS and thrown away
+            raise ValueError("Prefetching requires the shared cache, see OSS_CACHE_ALIAS")
+        if 'content' in what and not self.cache.max_content_size:
+            logger().info("content caching is disabled, content is not prefetched")
+            what.discard('content')
+
+        def prefetch_one(name):
+            if 'meta' in what or 'content' in what:
+                file_meta = self.get_file_meta(name)
+            if 'exists' in what:
+                self.exists(name)
+            if 'url' in what:
+                self.url(name)
+            if 'content' in what and file_meta.content_length <= self.cache.max_content_size:
+                self._download(self._get_key_name(name)).close()
+
+        workers = workers if workers else int(_get_config('OSS_PREFETCH_WORKERS', default=16))
+        failures = {}
+        for name, _, error in _run_concurrently(prefetch_one, names, workers):
+            if error is not None:
+                logger().warning("failed to prefetch %s: %s", name, error)
+                failures[name] = error
+        return failures
+
+    def archive(self, names, format='zip', **kwargs):
+        """
+        Return an iterable over the chunks of a zip or tar archive of the
+        files, downloaded concurrently with a bounded read ahead, see OssArchive.
+        """
+        from .archive import OssArchive
+        kwargs.setdefault('workers', int(_get_config('OSS_ARCHIVE_WORKERS', default=4)))
+        kwargs.setdefault('read_ahead', int(_get_config('OSS_ARCHIVE_READ_AHEAD', default=16*1024*1024)))  # 16MB
+        kwargs.setdefault('chunk_size', int(_get_config('OSS_STREAM_CHUNK_SIZE', default=64*1024)))  # 64KB
+        return OssArchive(self, names, format=format, **kwargs)
+
+    def save_archive(self, name, names, format='zip', **kwargs):
+        """
+        Save a zip or tar archive of the files as name, uploaded in parts
+        while the files are downloaded, and return the name.
+        """
+        with self.open(name, 'wb') as f:
+            for chunk in self.archive(names, format=format, **kwargs):
+                f.write(chunk)
+        return name
+
     def delete(self, name):
         name = self._get_key_name(name)
         logger().debug("delete name: %s", name)
-        result = self.bucket.delete_object(name)
+        if self.uploader is not None:
+            self.uploader.cancel(name)
+        with self.tracer.span('delete', key=name) as span:
+            result = self.bucket.delete_object(name)
+            span.set('request_id', result.request_id)
+        self._forget_append_position(name)
+        self._invalidate(name, deleted=True)
 
     def delete_with_slash(self, dirname):
         name = self._get_key_name(dirname)
         if not name.endswith('/'):
             name += '/'
         logger().debug("delete name: %s", name)
-        result = self.bucket.delete_object(name)
+        with self.tracer.span('delete', key=name) as span:
+            result = self.bucket.delete_object(name)
+            span.set('request_id', result.request_id)
+        self._invalidate(name, deleted=True)
 
 class OssMediaStorage(OssStorage):
     def __init__(self):
@@ -254,3 +1096,229 @@ class OssFile(File):
         if self.closed:
             self.file = self._storage.open(self.name, mode).file
         return super(OssFile, self).open(mode)
+
+
+class OssWriteFile(File):
+    """
+    A file opened in write mode, the upload completes when it is closed
+    """
+
+    def __init__(self, writer, name, storage):
+        super(OssWriteFile, self).__init__(writer, name)
+        self._storage = storage
+
+    def open(self, mode="wb"):
+        if self.closed:
+            raise ValueError("OSS files opened in write mode can't be reopened")
+        return self
+
+    def close(self):
+        super(OssWriteFile, self).close()
+        self._storage._invalidate(self._storage._get_key_name(self.name))
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # don't leave a partial object behind
+            self.file.abort()
+
+
+class OssMultipartWriter(object):
+    """
+    A write-only file object streaming its content to OSS.
+
+    Writes are buffered until a part is full, which is then uploaded by a
+    background thread while the next part is filled, so at most three parts
+    are held in memory. Content smaller than a part is uploaded by a single
+    put_object on close.
+    """
+
+    mode = "wb"
+
+    def __init__(self, bucket, key, part_size, headers=None, limiter=None, verify_crc=False, tracer=None):
+        self.bucket = bucket
+        self.name = key
+        self.part_size = part_size
+        self.headers = headers
+        self.limiter = limiter
+        self.tracer = tracer if tracer is not None else OssTracer()
+        # CRC64 of the whole content, computed while writing
+        self._crc = oss2.utils.Crc64(0) if verify_crc else None
+        self.closed = False
+        self.upload_id = None
+        self._buffer = bytearray()
+        self._position = 0
+        self._part_number = 0
+        self._parts = []
+        self._parts_queue = None
+        self._uploader = None
+        self._error = None
+
+    def readable(self):
+        return False
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        data = force_bytes(data)
+        if self._crc is not None:
+            self._crc.update(data)
+        self._buffer.extend(data)
+        self._position += len(data)
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            self._put_part(part)
+        return len(data)
+
+    def _put_part(self, data):
+        if self._error is not None:
+            raise self._error
+        if self.upload_id is None:
+            self.upload_id = self.bucket.init_multipart_upload(self.name, headers=self.headers).upload_id
+            logger().debug("init multipart upload, key: %s, upload id: %s", self.name, self.upload_id)
+            # the queue only holds one part, so the writer waits for the uploader
+            self._parts_queue = queue.Queue(maxsize=1)
+            self._uploader = threading.Thread(target=self.tracer.wrap(self._upload_parts))
+            self._uploader.daemon = True
+            self._uploader.start()
+        self._part_number += 1
+        self._parts_queue.put((self._part_number, data))
+
+    def _upload_parts(self):
+        while True:
+            item = self._parts_queue.get()
+            if item is None:
+                return
+            if self._error is not None:
+                # keep draining the queue so the writer never blocks
+                continue
+            part_number, data = item
+            try:
+                with self.tracer.span('upload_part', key=self.name, part=part_number, bytes=len(data)) as span:
+                    with transfer(self.limiter) as progress_callback:
+                        result = self.bucket.upload_part(self.name, self.upload_id, part_number, data,
+                                                         progress_callback=progress_callback)
+                    span.set('request_id', result.request_id)
+                self._parts.append(oss2.models.PartInfo(part_number, result.etag, size=len(data)))
+                logger().debug("uploaded part %d of %s, requestid: %s", part_number, self.name, result.request_id)
+            except Exception as e:
+                logger().error("failed to upload part %d of %s: %s", part_number, self.name, e)
+                self._error = e
+
+    def _stop_uploader(self):
+        if self._uploader is not None:
+            self._parts_queue.put(None)
+            self._uploader.join()
+            self._uploader = None
+
+    def close(self):
+        if self.closed:
+            return
+        with self.tracer.span('write', key=self.name, bytes=self._position) as span:
+            if self.upload_id is None:
+                self.closed = True
+                with transfer(self.limiter) as progress_callback:
+                    result = self.bucket.put_object(self.name, bytes(self._buffer), headers=self.headers,
+                                                    progress_callback=progress_callback)
+                self._buffer = bytearray()
+                span.set('request_id', result.request_id)
+                return
+
+            try:
+                if self._buffer:
+                    self._put_part(bytes(self._buffer))
+                    self._buffer = bytearray()
+                self._stop_uploader()
+                if self._error is not None:
+                    raise self._error
+                self._parts.sort(key=lambda part: part.part_number)
+                result = self.bucket.complete_multipart_upload(self.name, self.upload_id, self._parts)
+                self.closed = True
+            except Exception:
+                self.abort()
+                raise
+            span.set('parts', len(self._parts))
+            span.set('request_id', result.request_id)
+            if self._crc is not None:
+                oss2.utils.check_crc('complete multipart upload', self._crc.crc, result.crc, result.request_id)
+
+    def abort(self):
+        """
+        Discard the written content, aborting the multipart upload if any.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self._buffer = bytearray()
+        self._stop_uploader()
+        if self.upload_id is not None:
+            logger().debug("abort multipart upload, key: %s, upload id: %s", self.name, self.upload_id)
+            self.bucket.abort_multipart_upload(self.name, self.upload_id)
+
+
+class OssAppendWriter(object):
+    """
+    A write-only file object appending its content to an appendable object.
+
+    Writes are buffered and appended when the buffer is full, on flush and
+    on close.
+    """
+
+    mode = "ab"
+
+    def __init__(self, storage, name, buffer_size):
+        self.storage = storage
+        self.name = name
+        self.buffer_size = buffer_size
+        self.closed = False
+        self._buffer = bytearray()
+
+    def readable(self):
+        return False
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        data = force_bytes(data)
+        self._buffer.extend(data)
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self._buffer:
+            self.storage.append(self.name, bytes(self._buffer))
+            self._buffer = bytearray()
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        self.closed = True
+
+    def abort(self):
+        """
+        Discard the content not appended yet.
+        """
+        self.closed = True
+        self._buffer = bytearray()
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+"""
+Shared cache tier of OSS answers, stored in a Django cache so that all the
+worker processes share the urls, existence and metadata they looked up.
+"""
+
+import time
+import hashlib
+
+from collections import namedtuple
+from django.core.cache import caches
+from django.utils.encoding import force_bytes
+
+from .defaults import logger
+
+# Compact metadata record, with the attributes of oss2 GetObjectMetaResult used by the storage
+OssFileMeta = namedtuple('OssFileMeta', ['content_length', 'last_modified', 'etag'])
+
+
+class OssCache(object):
+    """
+    Cache of url(), exists() and get_file_meta() answers, and of the content
+    of small files.
+
+    Every object key has a generation number stored in the cache, which is
+    used as the version of its entries. Writing or deleting the object bumps
+    the generation, invalidating the entries of all processes at once.
+    Generations expire a few times later than the entries, so that the keys
+    looked up once don't stay in the cache forever.
+    """
+
+    # lifetime of the generations, in timeouts of the entries
+    GENERATION_TIMEOUTS = 4
+
+    URL = 'u'
+    EXISTS = 'e'
+    META = 'm'
+    CONTENT = 'c'
+
+    def __init__(self, alias, namespace, timeout, negative_timeout, key_prefix='oss', max_content_size=0):
+        self.alias = alias
+        self.namespace = namespace
+        self.timeout = timeout
+        self.negative_timeout = negative_timeout
+        self.key_prefix = key_prefix
+        self.max_content_size = max_content_size
+
+    @property
+    def cache(self):
+        # caches keeps one connection per thread
+        return caches[self.alias]
+
+    def _key(self, kind, target_name):
+        digest = hashlib.md5(force_bytes(self.namespace) + b'/' + force_bytes(target_name)).hexdigest()
+        return '%s:%s:%s' % (self.key_prefix, kind, digest)
+
+    def _generation(self, target_name):
+        key = self._key('g', target_name)
+        generation = self.cache.get(key)
+        if generation is None:
+            # start from the clock, so that entries written before the generation expired are never reused
+            timeout = max(self.timeout, self.negative_timeout) * self.GENERATION_TIMEOUTS
+            self.cache.add(key, int(time.time() * 1000), timeout)
+            generation = self.cache.get(key)
+        return generation
+
+    def get(self, kind, target_name):
+        try:
+            generation = self._generation(target_name)
+            value = self.cache.get(self._key(kind, target_name), version=generation)
+        except Exception as e:
+            logger().warning("failed to get '%s' from cache: %s", target_name, e)
+            return None, None
+        logger().debug("cache %s of '%s': %s", kind, target_name, "hit" if value is not None else "miss")
+        return generation, value
+
+    def set(self, kind, target_name, generation, value, timeout=None):
+        if generation is None:
+            return
+        if timeout is None:
+            timeout = self.timeout
+        try:
+            self.cache.set(self._key(kind, target_name), value, timeout, version=generation)
+        except Exception as e:
+            logger().warning("failed to set '%s' in cache: %s", target_name, e)
+
+    def get_url(self, target_name):
+        return self.get(self.URL, target_name)
+
+    def set_url(self, target_name, generation, url, timeout=None):
+        self.set(self.URL, target_name, generation, url, timeout)
+
+    def get_exists(self, target_name):
+        generation, value = self.get(self.EXISTS, target_name)
+        return generation, None if value is None else bool(value)
+
+    def set_exists(self, target_name, generation, exists):
+        timeout = self.timeout if exists else self.negative_timeout
+        self.set(self.EXISTS, target_name, generation, 1 if exists else 0, timeout)
+
+    def get_meta(self, target_name):
+        generation, value = self.get(self.META, target_name)
+        return generation, None if value is None else OssFileMeta(*value)
+
+    def set_meta(self, target_name, generation, meta):
+        self.set(self.META, target_name, generation, (meta.content_length, meta.last_modified, meta.etag))
+
+    def get_content(self, target_name):
+        return self.get(self.CONTENT, target_name)
+
+    def set_content(self, target_name, generation, content):
+        if len(content) <= self.max_content_size:
+            self.set(self.CONTENT, target_name, generation, content)
+
+    def invalidate(self, target_name):
+        """
+        Invalidate the entries of the object and of its parent directories,
+        whose existence may have changed with it.
+        """
+        # exists() is cached both with and without the trailing slash
+        names = []
+        parts = target_name.rstrip('/').split('/')
+        for i in range(len(parts)):
+            parent = '/'.join(parts[:i + 1])
+            names.extend([parent, parent + '/'])
+
+        for name in names:
+            key = self._key('g', name)
+            try:
+                self.cache.incr(key)
+            except ValueError:
+                # not cached yet, nothing to invalidate
+                pass
+            except Exception as e:
+                logger().warning("failed to invalidate '%s' in cache: %s", name, e)
+        logger().debug("cache invalidated: %s", names)
+
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+"""
+Client-side encrypted storage, on top of oss2 CryptoBucket.
+
+Objects are encrypted with AES-CTR while they are uploaded and decrypted
+while they are downloaded, under a random data key per object which is
+wrapped by a RSA key pair or by KMS (envelope encryption).
+"""
+
+import threading
+
+from collections import OrderedDict
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.deconstruct import deconstructible
+
+from .backends import OssStorage, _get_config
+from .defaults import logger
+from .lazy import LazyModule
+
+oss2 = LazyModule('oss2')
+
+
+def _cache_unwrapped_keys(provider, max_size):
+    """
+    Memoize the unwrapping of the data keys and IVs by the provider, so that
+    reading an object again doesn't call KMS or decrypt with RSA again. Each
+    object has its own data key and IV, so its first read still unwraps them.
+    """
+    cache = OrderedDict()
+    lock = threading.Lock()
+
+    def memoize(func):
+        def wrapper(encrypted, *args, **kwargs):
+            cache_key = (func.__name__, encrypted) + args
+            with lock:
+                if cache_key in cache:
+                    value = cache.pop(cache_key)
+                    cache[cache_key] = value
+                    return value
+            value = func(encrypted, *args, **kwargs)
+            with lock:
+                cache[cache_key] = value
+                while len(cache) > max_size:
+                    cache.popitem(last=False)
+            return value
+        return wrapper
+
+    # instance attributes take precedence over the methods of the provider
+    provider.decrypt_encrypted_key = memoize(provider.decrypt_encrypted_key)
+    provider.decrypt_encrypted_iv = memoize(provider.decrypt_encrypted_iv)
+    return provider
+
+
+def _get_crypto_provider(access_key_id, access_key_secret):
+    provider = _get_config('OSS_CRYPTO_PROVIDER', default='rsa').lower()
+    if provider == 'rsa':
+        key_pair = {
+            'private_key': _get_config('OSS_CRYPTO_RSA_PRIVATE_KEY'),
+            'public_key': _get_config('OSS_CRYPTO_RSA_PUBLIC_KEY'),
+        }
+        return oss2.RsaProvider(key_pair=key_pair, passphrase=_get_config('OSS_CRYPTO_RSA_PASSPHRASE', default='') or None)
+    elif provider == 'kms':
+        return oss2.AliKMSProvider(access_key_id, access_key_secret,
+                                   _get_config('OSS_CRYPTO_KMS_REGION'), _get_config('OSS_CRYPTO_KMS_CMK_ID'))
+    raise ImproperlyConfigured("OSS_CRYPTO_PROVIDER must be 'rsa' or 'kms', not '%s'" % provider)
+
+
+@deconstructible
+class OssEncryptedStorage(OssStorage):
+    """
+    Aliyun OSS Storage with client-side encryption
+
+    Urls of encrypted files can't be used to download them, serve them with
+    django_oss_storage.views.serve instead, without accel redirect. Range reads are decrypted from
+    the AES-CTR counter of the first block, without reading the file before.
+    """
+
+    # the CRC64 of OSS is the one of the encrypted content
+    verify_download_crc = False
+    encrypted = True
+
+    def __init__(self, crypto_provider=None, **kwargs):
+        self.crypto_provider = crypto_provider
+        super(OssEncryptedStorage, self).__init__(**kwargs)
+
+    def _create_bucket(self, end_point, bucket_name):
+        if self.crypto_provider is None:
+            provider = _get_crypto_provider(self.access_key_id, self.access_key_secret)
+            self.crypto_provider = _cache_unwrapped_keys(
+                provider, int(_get_config('OSS_CRYPTO_KEY_CACHE_SIZE', default=1024)))
+        return oss2.CryptoBucket(self.auth, end_point, bucket_name, crypto_provider=self.crypto_provider,
+                                 session=self.session, connect_timeout=self.connect_timeout)
+
+    def _open_write(self, name):
+        # the parts of an encrypted multipart upload need the size of the whole file
+        raise ValueError("Encrypted OSS files can't be opened in write mode, use save() instead")
+
+    def _open_append(self, name):
+        raise ValueError("Encrypted OSS files can't be opened in append mode")
+
+    def append(self, name, content):
+        raise ValueError("Encrypted OSS files can't be appended")
+
+
+class OssEncryptedMediaStorage(OssEncryptedStorage):
+    def __init__(self):
+        self.location = settings.MEDIA_URL
+        logger().debug("location: %s", self.location)
+        super(OssEncryptedMediaStorage, self).__init__()
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+
+"""
+Deferred uploads: files are spooled to a local directory and uploaded by
+background threads, so that saving them doesn't wait for OSS.
+"""
+
+import os
+import json
+import time
+import uuid
+import errno
+import threading
+
+from six.moves import queue
+
+import oss2
+
+from .defaults import logger
+from .throttle import transfer
+from .tracing import OssTracer
+
+
+if os.name == 'nt':
+    import ctypes
+
+    # os.kill() terminates the process on Windows, whatever the signal
+    def _pid_alive(pid):
+        kernel32 = ctypes.windll.kernel32
+        # PROCESS_QUERY_LIMITED_INFORMATION
+        handle = kernel32.OpenProcess(0x1000, False, pid)
+        if not handle:
+            # ERROR_ACCESS_DENIED: the process exists, but belongs to another user
+            return kernel32.GetLastError() == 5
+        try:
+            code = ctypes.c_ulong()
+            if not kernel32.GetExitCodeProcess(handle, ctypes.byref(code)):
+                return True
+            # STILL_ACTIVE
+            return code.value == 259
+        finally:
+            kernel32.CloseHandle(handle)
+else:
+    def _pid_alive(pid):
+        try:
+            os.kill(pid, 0)
+        except OSError as e:
+            return e.errno == errno.EPERM
+        return True
+
+
+class DeferredUpload(object):
+    def __init__(self, id, key, path, on_uploaded=None, limiter=None, headers=None, tracer=None):
+        self.id = id
+        self.key = key
+        self.path = path
+        self.headers = headers
+        self.on_uploaded = on_uploaded
+        self.limiter = limiter
+        self.tracer = tracer if tracer is not None else OssTracer()
+        self.cancelled = False
+
+
+class DeferredUploader(object):
+    """
+    Upload spooled files with a bounded pool of worker threads.
+
+    Each pending upload is journaled next to its spooled data as
+    <id>.<pid>.json, owned by the process which spooled it. At start, the
+    journal entries of dead processes are claimed and uploaded again, so
+    pending uploads survive a restart. Until its upload lands, a pending
+    file is served from the spool.
+
+    A key is uploaded by one worker at a time: a newer content waits for the
+    running upload of the key, so that the last saved content lands last.
+
+    An upload which failed all its retries stays pending, and is queued
+    again after requeue_delay seconds until it lands or is cancelled.
+    """
+
+    def __init__(self, bucket, spool_dir, workers=4, max_pending=1000, retries=5, retry_delay=1, requeue_delay=60):
+        self.bucket = bucket
+        self.spool_dir = spool_dir
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.requeue_delay = requeue_delay
+        self.pid = os.getpid()
+        self._pending = {}
+        # keys being uploaded, and the next upload of each one
+        self._running = set()
+        self._waiting = {}
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._unfinished = 0
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._queue = queue.Queue()
+
+        if not os.path.isdir(spool_dir):
+            os.makedirs(spool_dir)
+        self.recover()
+
+        for _ in range(workers):
+            t = threading.Thread(target=self._work)
+            t.daemon = True
+            t.start()
+
+    def _journal_path(self, id, pid=None):
+        return os.path.join(self.spool_dir, "%s.%d.json" % (id, pid if pid is not None else self.pid))
+
+    def _data_path(self, id):
+        return os.path.join(self.spool_dir, "%s.data" % id)
+
+    def _submit(self, upload, bounded):
+        with self._lock:
+            previous = self._pending.get(upload.key)
+            if previous is not None:
+                # the previous content is overwritten anyway
+                previous.cancelled = True
+            self._pending[upload.key] = upload
+            self._unfinished += 1
+        self._queue.put((upload, bounded))
+
+    def enqueue(self, key, content, on_uploaded=None, limiter=None, headers=None, tracer=None):
+        """
+        Spool the content and journal its upload with the headers, blocking
+        while max_pending uploads are waiting.
+        """
+        self._slots.acquire()
+        try:
+            id = uuid.uuid4().hex
+            path = self._data_path(id)
+            if hasattr(content, 'seek'):
+                content.seek(0)
+            with open(path, 'wb') as f:
+                if hasattr(content, 'chunks'):
+                    for chunk in content.chunks():
+                        f.write(chunk)
+                else:
+                    f.write(content.read() if hasattr(content, 'read') else content)
+                f.flush()
+                os.fsync(f.fileno())
+
+            # the journal is written atomically, after the data is durable
+            journal_path = self._journal_path(id)
+            with open(journal_path + '.tmp', 'w') as f:
+                json.dump({'key': key, 'created': time.time(), 'headers': headers}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(journal_path + '.tmp', journal_path)
+        except Exception:
+            self._slots.release()
+            raise
+
+        logger().debug("deferred upload of %s spooled to %s", key, path)
+        self._submit(DeferredUpload(id, key, path, on_uploaded, limiter, headers, tracer), True)
+
+    def recover(self):
+        """
+        Claim the journal entries of dead processes and upload them again.
+        """
+        entries = []
+        for filename in os.listdir(self.spool_dir):
+            parts = filename.split('.')
+            if len(parts) != 3 or parts[2] != 'json':
+                continue
+            id, pid = parts[0], int(parts[1])
+            if pid != self.pid and _pid_alive(pid):
+                continue
+            journal_path = os.path.join(self.spool_dir, filename)
+            try:
+                os.rename(journal_path, self._journal_path(id))
+                with open(self._journal_path(id)) as f:
+                    entry = json.load(f)
+            except (OSError, IOError, ValueError) as e:
+                # claimed by another process in the meantime
+                logger().debug("skip deferred upload journal %s: %s", filename, e)
+                continue
+            if not os.path.exists(self._data_path(id)):
+                logger().warning("spooled data of %s is missing, drop its deferred upload", entry['key'])
+                os.remove(self._journal_path(id))
+                continue
+            entries.append((entry['created'], id, entry['key'], entry.get('headers')))
+
+        for _, id, key, headers in sorted(entries):
+            logger().info("recover deferred upload of %s", key)
+            self._submit(DeferredUpload(id, key, self._data_path(id), headers=headers), False)
+
+    def _work(self):
+        while True:
+            upload, bounded = self._queue.get()
+            with self._lock:
+                if not upload.cancelled and upload.key in self._running:
+                    # queued behind the running upload of the key
+                    replaced = self._waiting.get(upload.key)
+                    self._waiting[upload.key] = (upload, bounded)
+                    if replaced is None:
+                        continue
+                    # cancelled by the newer upload, finished below
+                    upload, bounded = replaced
+                run = not upload.cancelled
+                if run:
+                    self._running.add(upload.key)
+            failed = False
+            try:
+                if run:
+                    self._upload(upload)
+                self._remove(upload)
+            except Exception as e:
+                failed = not upload.cancelled
+                if failed:
+                    # still served from the spool, and journaled for the next start
+                    logger().error("deferred upload of %s failed after %d retries, queued again in %ds: %s",
+                                   upload.key, self.retries, self.requeue_delay, e)
+                else:
+                    self._remove(upload)
+            finally:
+                with self._lock:
+                    if run:
+                        self._running.discard(upload.key)
+                        waiting = self._waiting.pop(upload.key, None)
+                        if waiting is not None:
+                            self._queue.put(waiting)
+                    if not failed:
+                        if self._pending.get(upload.key) is upload:
+                            del self._pending[upload.key]
+                        self._unfinished -= 1
+                    self._idle.notify_all()
+                if failed:
+                    timer = threading.Timer(self.requeue_delay, self._queue.put, [(upload, bounded)])
+                    timer.daemon = True
+                    timer.start()
+                elif bounded:
+                    self._slots.release()
+
+    def _upload(self, upload):
+        delay = self.retry_delay
+        with upload.tracer.span('deferred_upload', key=upload.key, bytes=os.path.getsize(upload.path)) as span:
+            for attempt in range(self.retries + 1):
+                if upload.cancelled:
+                    logger().debug("deferred upload of %s cancelled", upload.key)
+                    span.set('cancelled', True)
+                    return
+                span.set('retries', attempt)
+                try:
+                    with transfer(upload.limiter) as progress_callback:
+                        result = self.bucket.put_object_from_file(upload.key, upload.path, headers=upload.headers,
+                                                                  progress_callback=progress_callback)
+                    logger().debug("deferred upload of %s done, requestid: %s", upload.key, result.request_id)
+                    span.set('request_id', result.request_id)
+                    break
+                except Exception as e:
+                    if attempt == self.retries:
+                        raise
+                    logger().warning("deferred upload of %s failed, retry in %ds: %s", upload.key, delay, e)
+                    deadline = time.time() + delay
+                    while not upload.cancelled and time.time() < deadline:
+                        time.sleep(min(0.1, delay))
+                    delay = min(delay * 2, 60)
+        if upload.on_uploaded is not None:
+            upload.on_uploaded(upload.key)
+
+    def _remove(self, upload):
+        for path in (self._journal_path(upload.id), upload.path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def pending_path(self, key):
+        """
+        Get the spooled file of the key if its upload is pending, else None.
+        """
+        with self._lock:
+            upload = self._pending.get(key)
+            return upload.path if upload is not None else None
+
+    def cancel(self, key):
+        """
+        Cancel the pending upload of the key, and wait until its running
+        upload, if any, is done, e.g. before deleting the object.
+        """
+        with self._lock:
+            upload = self._pending.pop(key, None)
+            if upload is not None:
+                upload.cancelled = True
+            while key in self._running:
+                self._idle.wait()
+
+    def join(self, timeout=None):
+        """
+        Wait until all the pending uploads are done, returning False on timeout.
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        with self._lock:
+            while self._unfinished:
+                remaining = deadline - time.time() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+
+_uploaders = {}
+_uploaders_lock = threading.Lock()
+
+
+def get_uploader(bucket, spool_dir, **kwargs):
+    """
+    Get the uploader of the bucket, shared by the storages of the process.
+    """
+    primary = getattr(bucket, 'primary', bucket)
+    # the uploads of encrypted storages are spooled as plain text, and uploaded encrypted
+    namespace = bucket.bucket_name + ('-encrypted' if isinstance(primary, oss2.CryptoBucket) else '')
+    spool_dir = os.path.join(os.path.abspath(spool_dir), namespace)
+    with _uploaders_lock:
+        uploader = _uploaders.get(spool_dir)
+        if uploader is None:
+            uploader = _uploaders[spool_dir] = DeferredUploader(bucket, spool_dir, **kwargs)
+        return uploader
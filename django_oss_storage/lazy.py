@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+
+"""
+Modules imported on first use, so that importing the storages doesn't import
+oss2, and through it requests and the crypto modules.
+"""
+
+import importlib
+
+
+class LazyModule(object):
+    """
+    Module imported on the first access to one of its attributes.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        return "<lazy module '%s'>" % self._name
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+"""
+Storage classes of the uploaded objects, and restore status of the objects
+of the Archive storage classes, which must be restored before being read.
+"""
+
+import re
+
+from collections import namedtuple
+from email.utils import mktime_tz, parsedate_tz
+
+# states of OssRestoreStatus
+READABLE = 'readable'
+ARCHIVED = 'archived'
+RESTORING = 'restoring'
+RESTORED = 'restored'
+
+ARCHIVE_STORAGE_CLASSES = ('Archive', 'ColdArchive', 'DeepColdArchive')
+
+# storage_class of the object, state, and until when a restored object is readable (unix time)
+OssRestoreStatus = namedtuple('OssRestoreStatus', ['storage_class', 'state', 'expiry_time'])
+
+_expiry_re = re.compile(r'expiry-date="([^"]+)"')
+
+
+def is_archived_error(e):
+    """
+    Whether the oss2 exception was raised by reading an archived object.
+    """
+    return getattr(e, 'code', None) == 'InvalidObjectState'
+
+
+def get_restore_status(headers):
+    """
+    Get the OssRestoreStatus of an object from the headers of a HEAD request.
+    """
+    storage_class = headers.get('x-oss-storage-class', 'Standard')
+    if storage_class not in ARCHIVE_STORAGE_CLASSES:
+        return OssRestoreStatus(storage_class, READABLE, None)
+    restore = headers.get('x-oss-restore')
+    if not restore:
+        return OssRestoreStatus(storage_class, ARCHIVED, None)
+    if 'ongoing-request="true"' in restore:
+        return OssRestoreStatus(storage_class, RESTORING, None)
+    match = _expiry_re.search(restore)
+    expiry_date = parsedate_tz(match.group(1)) if match else None
+    return OssRestoreStatus(storage_class, RESTORED, mktime_tz(expiry_date) if expiry_date else None)
+
+
+class StorageClassPolicies(object):
+    """
+    Storage classes of the objects uploaded under key prefixes, the longest
+    matching prefix taking precedence, e.g. {'media/backups/': 'Archive'}.
+    """
+
+    def __init__(self, policies):
+        self.policies = sorted(policies.items(), key=lambda policy: len(policy[0]), reverse=True)
+
+    def storage_class(self, key):
+        for prefix, storage_class in self.policies:
+            if key.startswith(prefix):
+                return storage_class
+        return None
+
+    def headers(self, key):
+        """
+        Get the headers of an upload of the key, or None.
+        """
+        storage_class = self.storage_class(key)
+        return {'x-oss-storage-class': storage_class} if storage_class else None
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+from django.core.files.storage import default_storage, get_storage_class
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+
+class Command(BaseCommand):
+    help = "Report the size and object count of OSS directories, e.g. for quota reports."
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', default=[''],
+                            help="Directories to report on, relative to the storage location.")
+        parser.add_argument('--storage', default=None,
+                            help="Dotted path of the storage class, defaults to DEFAULT_FILE_STORAGE.")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Number of concurrent listing threads.")
+        parser.add_argument('-s', '--summarize', action='store_true',
+                            help="Only print a total for each path, not for each sub-directory.")
+        parser.add_argument('-H', '--human-readable', action='store_true',
+                            help="Print sizes in human readable format.")
+
+    def handle(self, *args, **options):
+        storage = get_storage_class(options['storage'])() if options['storage'] else default_storage
+        self.human_readable = options['human_readable']
+
+        for path in options['paths']:
+            top = storage._get_dir_key_name(path)
+            usage = {}
+            total_size = 0
+            total_count = 0
+            for dirpath, dirs, files in storage.walk(path, workers=options['workers']):
+                size = sum(obj.size for obj in files)
+                total_size += size
+                total_count += len(files)
+                if options['summarize'] or dirpath == top:
+                    continue
+                # account everything under top to its immediate sub-directory
+                child = top + dirpath[len(top):].split('/', 1)[0] + '/'
+                child_usage = usage.setdefault(child, [0, 0])
+                child_usage[0] += size
+                child_usage[1] += len(files)
+
+            for child in sorted(usage):
+                self.write_usage(child, *usage[child])
+            self.write_usage(top or '/', total_size, total_count)
+
+    def write_usage(self, path, size, count):
+        size = filesizeformat(size) if self.human_readable else size
+        self.stdout.write("%s\t%d\t%s" % (size, count, path))
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+import sys
+
+from django.apps import apps
+from django.core.files.storage import default_storage, get_storage_class
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = ("Prefetch the metadata, urls and content of hot files into the shared cache (OSS_CACHE_ALIAS), "
+            "e.g. on deploy so that the workers start warm.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help="Names of the files to prefetch.")
+        parser.add_argument('--from-file', default=None,
+                            help="File listing the names to prefetch, one per line, '-' to read stdin.")
+        parser.add_argument('--model', default=None,
+                            help="Model whose files are prefetched, as app_label.ModelName.")
+        parser.add_argument('--field', default=None,
+                            help="FileField of --model whose files are prefetched.")
+        parser.add_argument('--what', default='meta,url,content',
+                            help="Comma separated kinds to prefetch among meta, exists, url and content.")
+        parser.add_argument('--storage', default=None,
+                            help="Dotted path of the storage class, defaults to the field storage or DEFAULT_FILE_STORAGE.")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Number of concurrent threads.")
+
+    def handle(self, *args, **options):
+        names = list(options['names'])
+        storage = get_storage_class(options['storage'])() if options['storage'] else default_storage
+
+        if options['from_file']:
+            f = sys.stdin if options['from_file'] == '-' else open(options['from_file'])
+            try:
+                names.extend(line.strip() for line in f if line.strip())
+            finally:
+                if f is not sys.stdin:
+                    f.close()
+
+        if options['model']:
+            if not options['field']:
+                raise CommandError("--field is required with --model")
+            try:
+                model = apps.get_model(options['model'])
+                field = model._meta.get_field(options['field'])
+            except (LookupError, ValueError) as e:
+                raise CommandError(str(e))
+            if not options['storage']:
+                storage = field.storage
+            queryset = model._default_manager.exclude(**{options['field']: ''}).exclude(**{options['field'] + '__isnull': True})
+            names.extend(queryset.values_list(options['field'], flat=True).iterator())
+
+        if not names:
+            raise CommandError("No file to prefetch")
+
+        what = [kind.strip() for kind in options['what'].split(',') if kind.strip()]
+        try:
+            failures = storage.prefetch(names, what=what, workers=options['workers'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        for name in sorted(failures):
+            self.stderr.write("%s: %s" % (name, failures[name]))
+        self.stdout.write("Prefetched %d files, %d failed" % (len(names) - len(failures), len(failures)))
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+from django.core.files.storage import default_storage, get_storage_class
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Build or refresh the local snapshot of the prefix configured by OSS_SNAPSHOT_PATH and OSS_SNAPSHOT_PREFIX."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--refresh', action='store_true',
+                            help="Only add the objects listed after the last key of the snapshot.")
+        parser.add_argument('--inventory', default=None,
+                            help="Key of the manifest.json of an OSS inventory report to build the snapshot from.")
+        parser.add_argument('--storage', default=None,
+                            help="Dotted path of the storage class, defaults to DEFAULT_FILE_STORAGE.")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Number of concurrent listing or download threads.")
+
+    def handle(self, *args, **options):
+        storage = get_storage_class(options['storage'])() if options['storage'] else default_storage
+        snapshot = getattr(storage, 'snapshot', None)
+        if snapshot is None:
+            raise CommandError("OSS_SNAPSHOT_PATH is not set")
+
+        if options['inventory']:
+            count = snapshot.load_inventory(storage, options['inventory'], workers=options['workers'])
+        elif options['refresh']:
+            count = snapshot.refresh(storage)
+        else:
+            count = snapshot.build(storage, workers=options['workers'])
+        self.stdout.write("Snapshot of %s: %d objects" % (snapshot.prefix, count))
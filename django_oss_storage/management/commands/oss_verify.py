@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+from django.core.files.storage import default_storage, get_storage_class
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Verify that the files of a local directory match the objects of an OSS directory."
+
+    def add_arguments(self, parser):
+        parser.add_argument('local_root', help="Local directory, e.g. STATIC_ROOT.")
+        parser.add_argument('prefix', nargs='?', default='',
+                            help="OSS directory, relative to the storage location.")
+        parser.add_argument('--spot-checks', type=int, default=0,
+                            help="Number of random ranges of each file compared byte by byte.")
+        parser.add_argument('--spot-size', type=int, default=64 * 1024,
+                            help="Size in bytes of the spot checked ranges.")
+        parser.add_argument('--storage', default=None,
+                            help="Dotted path of the storage class, defaults to DEFAULT_FILE_STORAGE.")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Number of concurrent threads.")
+
+    def handle(self, *args, **options):
+        storage = get_storage_class(options['storage'])() if options['storage'] else default_storage
+        try:
+            problems = storage.verify(options['local_root'], options['prefix'], spot_checks=options['spot_checks'],
+                                      spot_size=options['spot_size'], workers=options['workers'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        for name, problem in problems:
+            self.stdout.write("%s: %s" % (name, problem))
+        if problems:
+            raise CommandError("%d files differ" % len(problems))
+        self.stdout.write("All files match")
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+"""
+Read routing between several endpoints of a bucket, e.g. a primary bucket
+and its cross-region replicas, or the intranet and extranet endpoints.
+"""
+
+import time
+import threading
+
+import oss2.exceptions
+
+from .defaults import logger
+
+
+class EndpointStats(object):
+    """
+    Rolling latency and error rate of an endpoint, as exponentially weighted
+    moving averages.
+    """
+
+    def __init__(self, endpoint, alpha=0.2):
+        self.endpoint = endpoint
+        self.alpha = alpha
+        self.latency = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.unhealthy_until = 0
+
+    def record(self, latency, error):
+        self.requests += 1
+        if error:
+            self.errors += 1
+            self.error_rate += self.alpha * (1 - self.error_rate)
+        else:
+            self.error_rate -= self.alpha * self.error_rate
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += self.alpha * (latency - self.latency)
+
+    def is_healthy(self, now):
+        return now >= self.unhealthy_until
+
+    def as_dict(self, now):
+        return {
+            'endpoint': self.endpoint,
+            'latency': self.latency,
+            'error_rate': self.error_rate,
+            'requests': self.requests,
+            'errors': self.errors,
+            'healthy': self.is_healthy(now),
+        }
+
+
+class OssRoutingBucket(object):
+    """
+    A Bucket sending reads to the fastest healthy endpoint and everything
+    else, writes included, to the primary bucket.
+
+    Endpoints whose error rate exceeds max_error_rate are skipped for
+    cooldown seconds. A failed read is retried on the next endpoint, and a
+    missing object on a replica is looked up again on the primary, as the
+    replication may lag behind.
+    """
+
+    READ_METHODS = frozenset(['get_object', 'get_object_meta', 'head_object', 'object_exists', 'list_objects'])
+
+    def __init__(self, primary, replicas, max_error_rate=0.5, cooldown=30):
+        self.primary = primary
+        self.buckets = [primary] + list(replicas)
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self._stats = [EndpointStats(bucket.endpoint) for bucket in self.buckets]
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if name in self.READ_METHODS:
+            def routed(*args, **kwargs):
+                return self._read(name, *args, **kwargs)
+            return routed
+        return getattr(self.primary, name)
+
+    def _candidates(self):
+        """
+        Get the indexes of the endpoints in the order to try, healthy ones
+        first by latency. Endpoints without latency yet are tried first so
+        that they get measured.
+        """
+        now = time.time()
+        with self._lock:
+            healthy = [i for i, stats in enumerate(self._stats) if stats.is_healthy(now)]
+            unhealthy = [i for i, stats in enumerate(self._stats) if not stats.is_healthy(now)]
+            healthy.sort(key=lambda i: (self._stats[i].latency is not None, self._stats[i].latency or 0))
+            unhealthy.sort(key=lambda i: self._stats[i].unhealthy_until)
+        return healthy + unhealthy
+
+    def _record(self, index, latency, error):
+        with self._lock:
+            stats = self._stats[index]
+            stats.record(latency, error)
+            if error and stats.error_rate > self.max_error_rate and stats.is_healthy(time.time()):
+                stats.unhealthy_until = time.time() + self.cooldown
+                logger().warning("endpoint %s is unhealthy for %ds, error rate: %.2f",
+                                 stats.endpoint, self.cooldown, stats.error_rate)
+
+    def _read(self, method, *args, **kwargs):
+        candidates = self._candidates()
+        error = None
+        for index in candidates:
+            bucket = self.buckets[index]
+            logger().debug("route %s to %s", method, bucket.endpoint)
+            start = time.time()
+            try:
+                result = getattr(bucket, method)(*args, **kwargs)
+            except oss2.exceptions.NotFound:
+                self._record(index, time.time() - start, False)
+                if bucket is self.primary:
+                    raise
+                logger().debug("%s not found on %s, read from primary", method, bucket.endpoint)
+                return getattr(self.primary, method)(*args, **kwargs)
+            except oss2.exceptions.ServerError as e:
+                if e.status is not None and 0 < e.status < 500:
+                    # the answer of OSS, not a failure of the endpoint
+                    self._record(index, time.time() - start, False)
+                    raise
+                self._record(index, time.time() - start, True)
+                error = e
+            except oss2.exceptions.RequestError as e:
+                self._record(index, time.time() - start, True)
+                error = e
+            else:
+                self._record(index, time.time() - start, False)
+                if method == 'object_exists' and not result and bucket is not self.primary:
+                    logger().debug("%s not found on %s, read from primary", method, bucket.endpoint)
+                    return self.primary.object_exists(*args, **kwargs)
+                return result
+            logger().warning("%s failed on %s, failover: %s", method, bucket.endpoint, error)
+        raise error
+
+    def stats(self):
+        """
+        Get the routing statistics of each endpoint, in routing order.
+        """
+        now = time.time()
+        candidates = self._candidates()
+        with self._lock:
+            return [self._stats[i].as_dict(now) for i in candidates]
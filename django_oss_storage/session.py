@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+"""
+HTTP sessions shared by the buckets of the process, with a configurable
+connection pool and TCP keep-alive.
+"""
+
+import socket
+import threading
+
+import oss2
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+from .defaults import logger
+
+
+def keepalive_socket_options(idle=60, interval=10, count=6):
+    """
+    Socket options enabling TCP keep-alive, on top of the default TCP_NODELAY,
+    so that idle pooled connections are kept open by NATs and load balancers.
+    """
+    options = list(HTTPConnection.default_socket_options)
+    options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+    # not available on every platform
+    for name, value in (('TCP_KEEPIDLE', idle), ('TCP_KEEPINTVL', interval), ('TCP_KEEPCNT', count)):
+        if hasattr(socket, name):
+            options.append((socket.IPPROTO_TCP, getattr(socket, name), value))
+    return options
+
+
+class OssHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter setting the socket options of the pooled connections.
+    """
+
+    def __init__(self, socket_options=None, **kwargs):
+        # set before HTTPAdapter.__init__ which creates the pool manager
+        self.socket_options = socket_options
+        super(OssHTTPAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        if self.socket_options is not None:
+            pool_kwargs['socket_options'] = self.socket_options
+        super(OssHTTPAdapter, self).init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+
+
+class OssSession(oss2.Session):
+    """
+    oss2 Session with a pool of pool_size connections per host, shared by all
+    the buckets and threads of the process.
+    """
+
+    def __init__(self, pool_size, pool_block=False, socket_options=None):
+        super(OssSession, self).__init__()
+        self.adapter = OssHTTPAdapter(socket_options=socket_options, pool_connections=pool_size,
+                                      pool_maxsize=pool_size, pool_block=pool_block)
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+
+    def pool_stats(self):
+        """
+        Get the statistics of the connection pool of each host: requests,
+        connections opened (misses), requests on a pooled connection (hits)
+        and idle connections.
+        """
+        stats = []
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            # the queue of urllib3 is filled with None placeholders for the connections not opened yet
+            idle = sum(1 for connection in list(pool.pool.queue) if connection is not None) if pool.pool is not None else 0
+            stats.append({
+                'host': pool.host,
+                'requests': pool.num_requests,
+                'misses': pool.num_connections,
+                'hits': max(pool.num_requests - pool.num_connections, 0),
+                'idle': idle,
+                'size': pool.pool.maxsize if pool.pool is not None else 0,
+            })
+        return stats
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(pool_size, pool_block=False, tcp_keepalive=None):
+    """
+    Get the session of the process for the pool settings, tcp_keepalive
+    being None or the (idle, interval, count) of TCP keep-alive.
+    """
+    key = (pool_size, pool_block, tcp_keepalive)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            socket_options = keepalive_socket_options(*tcp_keepalive) if tcp_keepalive else None
+            session = _sessions[key] = OssSession(pool_size, pool_block=pool_block, socket_options=socket_options)
+            logger().debug("session of pool size: %d, block: %s, tcp keepalive: %s", pool_size, pool_block, tcp_keepalive)
+        return session
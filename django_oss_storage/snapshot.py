@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+
+"""
+Snapshot index of a mostly-static prefix of a bucket, in a local SQLite
+database, answering exists(), size() and listdir() without any request.
+"""
+
+import io
+import os
+import csv
+import json
+import gzip
+import time
+import shutil
+import sqlite3
+import calendar
+import threading
+
+from datetime import datetime
+from six.moves.urllib.parse import unquote
+
+import oss2
+
+from .cache import OssFileMeta
+from .defaults import logger
+
+SCHEMA = """
+CREATE TABLE objects (key TEXT PRIMARY KEY, parent TEXT NOT NULL, size INTEGER, last_modified INTEGER, etag TEXT);
+CREATE INDEX objects_parent ON objects (parent, key);
+CREATE TABLE dirs (key TEXT PRIMARY KEY, parent TEXT NOT NULL);
+CREATE INDEX dirs_parent ON dirs (parent, key);
+CREATE TABLE info (name TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def _parent(key):
+    return key.rstrip('/').rsplit('/', 1)[0] + '/' if '/' in key.rstrip('/') else ''
+
+
+def _parse_inventory_time(value):
+    # e.g. 2019-06-13T02:27:52Z
+    return calendar.timegm(datetime.strptime(value[:19], '%Y-%m-%dT%H:%M:%S').timetuple())
+
+
+class OssSnapshot(object):
+    """
+    Snapshot of the objects under a key prefix.
+
+    The database is built in a temporary file which then replaces the
+    previous one, so readers never see a partial snapshot. Readers reopen
+    the database when it is replaced. The snapshot is only used while it is
+    younger than max_age seconds (0 for no limit). Files written or deleted
+    by this process since the snapshot was loaded are tracked in memory.
+    """
+
+    def __init__(self, path, prefix, max_age=86400):
+        self.path = path
+        self.prefix = prefix
+        self.max_age = max_age
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._overlay = {}
+        self._inode = None
+        self._checked = 0
+
+    def covers(self, key):
+        return key.startswith(self.prefix)
+
+    def _connection(self):
+        """
+        Get the connection of the thread, reopened at most once per second if
+        the database was replaced. Returns None if there is no snapshot, or if
+        it can't be opened.
+
+        The creation time of the snapshot is kept with the connection of each
+        thread, since other threads may already see a newer database.
+        """
+        now = time.time()
+        if now - self._checked >= 1:
+            self._checked = now
+            try:
+                inode = os.stat(self.path).st_ino
+            except OSError:
+                inode = None
+            if inode != self._inode:
+                with self._lock:
+                    self._inode = inode
+                    self._overlay = {}
+
+        inode = self._inode
+        if inode is None:
+            return None
+        connection = getattr(self._local, 'connection', None)
+        if getattr(self._local, 'inode', None) != inode:
+            if connection is not None:
+                connection.close()
+            self._local.connection = connection = None
+            self._local.inode = inode
+            try:
+                connection = sqlite3.connect(self.path, check_same_thread=False)
+                row = connection.execute("SELECT value FROM info WHERE name = 'created'").fetchone()
+            except sqlite3.Error as e:
+                # removed or replaced while being opened, retried once replaced again
+                logger().warning("failed to open the snapshot %s: %s", self.path, e)
+                if connection is not None:
+                    connection.close()
+                return None
+            self._local.connection = connection
+            self._local.created = float(row[0]) if row else 0
+        return connection
+
+    def is_fresh(self):
+        connection = self._connection()
+        if connection is None:
+            return False
+        return not self.max_age or time.time() - self._local.created <= self.max_age
+
+    def usable(self, key):
+        return self.covers(key) and self.is_fresh()
+
+    def record_write(self, key, size, last_modified=None):
+        with self._lock:
+            self._overlay[key] = OssFileMeta(size, last_modified or int(time.time()), None)
+
+    def record_delete(self, key):
+        with self._lock:
+            self._overlay[key] = None
+
+    def lookup(self, key):
+        """
+        Get the OssFileMeta of the object, or None if it is not in the snapshot.
+        """
+        with self._lock:
+            if key in self._overlay:
+                return self._overlay[key]
+        connection = self._connection()
+        if connection is None:
+            return None
+        row = connection.execute("SELECT size, last_modified, etag FROM objects WHERE key = ?", (key,)).fetchone()
+        return OssFileMeta(*row) if row else None
+
+    def is_dir(self, prefix):
+        with self._lock:
+            if any(key.startswith(prefix) for key, meta in self._overlay.items() if meta is not None):
+                return True
+        connection = self._connection()
+        if connection is None:
+            return False
+        if prefix == self.prefix:
+            return connection.execute("SELECT 1 FROM objects LIMIT 1").fetchone() is not None
+        return connection.execute("SELECT 1 FROM dirs WHERE key = ?", (prefix,)).fetchone() is not None
+
+    def listdir(self, prefix):
+        connection = self._connection()
+        dirs = []
+        files = []
+        if connection is not None:
+            dirs = [row[0] for row in connection.execute("SELECT key FROM dirs WHERE parent = ? ORDER BY key", (prefix,))]
+            files = [row[0] for row in connection.execute("SELECT key FROM objects WHERE parent = ? ORDER BY key", (prefix,))]
+        with self._lock:
+            overlay = dict((key, meta) for key, meta in self._overlay.items() if _parent(key) == prefix)
+        if overlay:
+            files = sorted(set(key for key in files if overlay.get(key, True) is not None) |
+                           set(key for key, meta in overlay.items() if meta is not None))
+        return dirs, files
+
+    def _create(self):
+        tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        connection = sqlite3.connect(tmp_path)
+        connection.executescript(SCHEMA)
+        return connection, tmp_path
+
+    def _commit(self, connection, tmp_path, marker):
+        connection.executemany("INSERT OR REPLACE INTO info (name, value) VALUES (?, ?)",
+                               [('prefix', self.prefix), ('created', repr(time.time())), ('marker', marker)])
+        connection.commit()
+        connection.close()
+        os.rename(tmp_path, self.path)
+        self._checked = 0
+
+    def _insert_dirs(self, connection, key):
+        parent = _parent(key)
+        while len(parent) > len(self.prefix):
+            connection.execute("INSERT OR IGNORE INTO dirs (key, parent) VALUES (?, ?)", (parent, _parent(parent)))
+            parent = _parent(parent)
+
+    def build(self, storage, workers=None):
+        """
+        Build the snapshot from a full listing of the prefix, listing its
+        directories concurrently.
+        """
+        start = time.time()
+        connection, tmp_path = self._create()
+        marker = ''
+        count = 0
+        try:
+            for dirpath, dirs, files in storage._walk_keys(self.prefix, workers):
+                connection.executemany("INSERT OR IGNORE INTO dirs (key, parent) VALUES (?, ?)",
+                                       [(d, dirpath) for d in dirs])
+                connection.executemany(
+                    "INSERT OR REPLACE INTO objects (key, parent, size, last_modified, etag) VALUES (?, ?, ?, ?, ?)",
+                    [(obj.key, dirpath, obj.size, obj.last_modified, obj.etag) for obj in files])
+                count += len(files)
+                if files:
+                    marker = max(marker, files[-1].key)
+        except Exception:
+            connection.close()
+            os.remove(tmp_path)
+            raise
+        self._commit(connection, tmp_path, marker)
+        logger().info("snapshot of %s built: %d objects in %.1fs", self.prefix, count, time.time() - start)
+        return count
+
+    def refresh(self, storage):
+        """
+        Add the objects listed after the last key of the snapshot. Objects
+        added before it, or deleted, are only seen by the next build.
+        """
+        if self._connection() is None:
+            return self.build(storage)
+        # refresh a copy, then replace the snapshot like a build
+        tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        shutil.copyfile(self.path, tmp_path)
+        connection = sqlite3.connect(tmp_path)
+        row = connection.execute("SELECT value FROM info WHERE name = 'marker'").fetchone()
+        marker = row[0] if row else ''
+        count = 0
+        for obj in oss2.ObjectIterator(storage.bucket, prefix=self.prefix, marker=marker):
+            if obj.key.endswith('/'):
+                connection.execute("INSERT OR IGNORE INTO dirs (key, parent) VALUES (?, ?)", (obj.key, _parent(obj.key)))
+            else:
+                connection.execute(
+                    "INSERT OR REPLACE INTO objects (key, parent, size, last_modified, etag) VALUES (?, ?, ?, ?, ?)",
+                    (obj.key, _parent(obj.key), obj.size, obj.last_modified, obj.etag))
+                count += 1
+            self._insert_dirs(connection, obj.key)
+            marker = obj.key
+        self._commit(connection, tmp_path, marker)
+        logger().info("snapshot of %s refreshed: %d new objects", self.prefix, count)
+        return count
+
+    def load_inventory(self, storage, manifest_key, workers=None):
+        """
+        Build the snapshot from an OSS inventory report, given the key of its
+        manifest.json, downloading its CSV files concurrently.
+        """
+        from .backends import _run_concurrently
+
+        start = time.time()
+        manifest = json.loads(storage.bucket.get_object(manifest_key).read().decode('utf-8'))
+        schema = [field.strip() for field in manifest['fileSchema'].split(',')]
+        key_index, size_index = schema.index('Key'), schema.index('Size')
+        modified_index = schema.index('LastModifiedDate') if 'LastModifiedDate' in schema else None
+        etag_index = schema.index('ETag') if 'ETag' in schema else None
+
+        connection, tmp_path = self._create()
+        marker = ''
+        count = 0
+        try:
+            download = lambda f: storage.bucket.get_object(f['key']).read()
+            for _, data, error in _run_concurrently(download, manifest['files'], workers or 8):
+                if error is not None:
+                    raise error
+                reader = csv.reader(io.TextIOWrapper(gzip.GzipFile(fileobj=io.BytesIO(data)), encoding='utf-8'))
+                for row in reader:
+                    key = unquote(row[key_index])
+                    if not self.covers(key) or key == self.prefix:
+                        continue
+                    if key.endswith('/'):
+                        connection.execute("INSERT OR IGNORE INTO dirs (key, parent) VALUES (?, ?)", (key, _parent(key)))
+                    else:
+                        connection.execute(
+                            "INSERT OR REPLACE INTO objects (key, parent, size, last_modified, etag) VALUES (?, ?, ?, ?, ?)",
+                            (key, _parent(key), int(row[size_index]),
+                             _parse_inventory_time(row[modified_index]) if modified_index is not None else None,
+                             row[etag_index] if etag_index is not None else None))
+                        count += 1
+                        marker = max(marker, key)
+                    self._insert_dirs(connection, key)
+        except Exception:
+            connection.close()
+            os.remove(tmp_path)
+            raise
+        self._commit(connection, tmp_path, marker)
+        logger().info("snapshot of %s loaded from inventory: %d objects in %.1fs", self.prefix, count, time.time() - start)
+        return count
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+"""
+Process-wide bandwidth and concurrency limits of the transfers to and from
+OSS, hooked into the progress callbacks of oss2.
+"""
+
+import time
+import threading
+
+from contextlib import contextmanager
+
+from .defaults import logger
+
+
+class TokenBucket(object):
+    """
+    Token bucket of rate bytes per second, with a burst of one second.
+
+    Consuming more tokens than available reserves them and sleeps until they
+    are refilled, so concurrent transfers share the rate fairly.
+    """
+
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.tokens = self.rate
+        self.updated = time.time()
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        with self._lock:
+            now = time.time()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class TransferLimiter(object):
+    """
+    Limit the bandwidth (bytes per second, shared by uploads and downloads)
+    and the number of concurrent transfers, 0 meaning no limit, and measure
+    the throughput over the last window seconds.
+    """
+
+    def __init__(self, name, bandwidth=0, concurrency=0, window=5):
+        self.name = name
+        self.bandwidth = bandwidth
+        self.concurrency = concurrency
+        self.window = window
+        self._bucket = TokenBucket(bandwidth) if bandwidth else None
+        self._slots = threading.BoundedSemaphore(concurrency) if concurrency else None
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiting = 0
+        self._bytes = 0
+        # bytes transferred per second, over the window
+        self._seconds = {}
+
+    def _record(self, amount):
+        second = int(time.time())
+        with self._lock:
+            self._bytes += amount
+            self._seconds[second] = self._seconds.get(second, 0) + amount
+            if len(self._seconds) > self.window + 1:
+                for s in [s for s in self._seconds if s <= second - self.window]:
+                    del self._seconds[s]
+
+    @contextmanager
+    def transfer(self):
+        """
+        Wait for a transfer slot, and yield the progress callback to pass to
+        oss2 for the transfer.
+        """
+        if self._slots is not None:
+            with self._lock:
+                self._waiting += 1
+            try:
+                self._slots.acquire()
+            finally:
+                with self._lock:
+                    self._waiting -= 1
+        with self._lock:
+            self._active += 1
+
+        consumed = [0]
+
+        def progress_callback(bytes_consumed, total_bytes):
+            amount = bytes_consumed - consumed[0]
+            consumed[0] = bytes_consumed
+            if amount <= 0:
+                return
+            self._record(amount)
+            if self._bucket is not None:
+                self._bucket.consume(amount)
+
+        try:
+            yield progress_callback
+        finally:
+            with self._lock:
+                self._active -= 1
+            if self._slots is not None:
+                self._slots.release()
+
+    def stats(self):
+        """
+        Get the throughput in bytes per second over the window, the number of
+        active and waiting transfers, and the total of bytes transferred.
+        """
+        now = int(time.time())
+        with self._lock:
+            recent = sum(amount for second, amount in self._seconds.items() if now - self.window <= second < now)
+            return {
+                'name': self.name,
+                'throughput': recent / float(self.window),
+                'active': self._active,
+                'waiting': self._waiting,
+                'bytes': self._bytes,
+                'bandwidth': self.bandwidth,
+                'concurrency': self.concurrency,
+            }
+
+
+@contextmanager
+def unlimited():
+    """
+    Context of an unlimited transfer, without progress callback.
+    """
+    yield None
+
+
+def transfer(limiter):
+    return limiter.transfer() if limiter is not None else unlimited()
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name, limits):
+    """
+    Get the limiter shared by the storages of the process named name, from
+    the limits of OSS_TRANSFER_LIMITS, or None if it has no limits.
+    """
+    config = limits.get(name, limits.get('default'))
+    if not config:
+        return None
+    bandwidth = int(config.get('bandwidth', 0))
+    concurrency = int(config.get('concurrency', 0))
+    with _limiters_lock:
+        limiter = _limiters.get((name, bandwidth, concurrency))
+        if limiter is None:
+            limiter = TransferLimiter(name, bandwidth=bandwidth, concurrency=concurrency)
+            _limiters[(name, bandwidth, concurrency)] = limiter
+            logger().debug("transfer limiter of %s: bandwidth: %d, concurrency: %d",
+                           name, limiter.bandwidth, limiter.concurrency)
+        return limiter
+
+
+def all_stats():
+    """
+    Get the stats of all the limiters of the process, e.g. for monitoring.
+    """
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return [limiter.stats() for limiter in limiters]
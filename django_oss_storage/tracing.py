@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+"""
+OpenTelemetry spans of the storage operations, sampled so that individual
+slow requests to OSS can be seen in production.
+
+opentelemetry-api is only imported when tracing is enabled. When it is
+disabled, or a span is not sampled, the operations get a shared no-op span.
+"""
+
+import random
+
+from django.core.exceptions import ImproperlyConfigured
+
+
+class NoopSpan(object):
+    """
+    Span which records nothing.
+    """
+
+    def set(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class OssSpan(object):
+    """
+    Span of a storage operation, whose attributes are prefixed with 'oss.'.
+    The request id of a failed request is taken from the oss2 exception.
+    """
+
+    def __init__(self, tracer, name, attributes):
+        self._tracer = tracer
+        self._name = name
+        self._attributes = attributes
+        self._context = None
+        self._span = None
+
+    def set(self, key, value):
+        if value is not None:
+            self._span.set_attribute('oss.' + key, value)
+
+    def __enter__(self):
+        self._context = self._tracer.start_as_current_span(self._name)
+        self._span = self._context.__enter__()
+        for key, value in self._attributes.items():
+            self.set(key, value)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_value is not None:
+            # the oss2 exception, or the one it was translated from
+            for error in (exc_value, getattr(exc_value, '__context__', None)):
+                if getattr(error, 'request_id', None):
+                    self.set('request_id', error.request_id)
+                    break
+        return self._context.__exit__(exc_type, exc_value, traceback)
+
+
+class OssTracer(object):
+    """
+    Start spans for sample_rate (0 to 1) of the operations, and for all the
+    operations inside a sampled span, e.g. of a traced Django request.
+    """
+
+    def __init__(self, sample_rate=0, tracer_provider=None):
+        self.sample_rate = sample_rate
+        self._tracer = None
+        self._trace = None
+        self._context = None
+        if sample_rate:
+            try:
+                from opentelemetry import context, trace
+            except ImportError:
+                raise ImproperlyConfigured("OSS_TRACE_SAMPLE_RATE requires the opentelemetry-api package")
+            self._trace = trace
+            self._context = context
+            self._tracer = trace.get_tracer('django_oss_storage', tracer_provider=tracer_provider)
+
+    def span(self, operation, **attributes):
+        """
+        Get the span of the operation, to use as a context manager.
+        """
+        if not self.sample_rate:
+            return NOOP_SPAN
+        if self.sample_rate < 1 and random.random() >= self.sample_rate \
+                and not self._trace.get_current_span().is_recording():
+            return NOOP_SPAN
+        return OssSpan(self._tracer, 'oss.' + operation, attributes)
+
+    def wrap(self, func):
+        """
+        Bind func, e.g. the target of a worker thread, to the current trace
+        context, so that the spans it starts are children of the current span.
+        """
+        if not self.sample_rate:
+            return func
+        current = self._context.get_current()
+
+        def run(*args, **kwargs):
+            token = self._context.attach(current)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._context.detach(token)
+        return run
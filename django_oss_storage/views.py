@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+"""
+Views serving OSS files through Django, e.g. private media behind
+permission checks, without downloading them first.
+"""
+
+import os
+import re
+
+from django.core.exceptions import PermissionDenied
+from django.core.files.storage import default_storage
+from django.http import Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import urlquote
+from django.views.generic import View
+
+from .backends import _get_config
+from .defaults import logger
+from .lazy import LazyModule
+from .lifecycle import is_archived_error
+
+oss2 = LazyModule('oss2')
+
+# Request headers passed through to OSS, for 304 and 412 answers
+CONDITIONAL_HEADERS = ('If-None-Match', 'If-Modified-Since', 'If-Match', 'If-Unmodified-Since')
+
+# Response headers of OSS passed through to the client
+RESPONSE_HEADERS = ('Content-Type', 'Content-Length', 'Content-Range', 'ETag', 'Last-Modified',
+                    'Cache-Control', 'Content-Encoding', 'Content-Language', 'Expires')
+
+ARCHIVE_CONTENT_TYPES = {'zip': 'application/zip', 'tar': 'application/x-tar'}
+
+_range_re = re.compile(r'^\s*bytes=(\d*)-(\d*)\s*$')
+_content_range_re = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+
+
+def _parse_range(header):
+    """
+    Parse a single byte range header into the byte_range of oss2, or None
+    if it is missing or not supported, e.g. multiple ranges.
+    """
+    if not header:
+        return None
+    match = _range_re.match(header)
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    start = int(start) if start else None
+    end = int(end) if end else None
+    if start is not None and end is not None and end < start:
+        return None
+    return start, end
+
+
+class OssObjectChunks(object):
+    """
+    Iterate over the content of an OSS object in fixed-size chunks, and
+    release its connection when the response is closed.
+    """
+
+    def __init__(self, obj, chunk_size):
+        self.obj = obj
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        while True:
+            chunk = self.obj.read(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        self.obj.resp.response.close()
+
+
+class OssStreamingResponse(StreamingHttpResponse):
+    """
+    A response streaming an OSS object (oss2 GetObjectResult) to the client.
+    """
+
+    def __init__(self, obj, chunk_size=None, as_attachment=False, filename=None, *args, **kwargs):
+        if chunk_size is None:
+            chunk_size = int(_get_config('OSS_STREAM_CHUNK_SIZE', default=64*1024))  # 64KB
+        super(OssStreamingResponse, self).__init__(OssObjectChunks(obj, chunk_size), *args, **kwargs)
+
+        for header in RESPONSE_HEADERS:
+            value = obj.headers.get(header)
+            if value is not None:
+                self[header] = value
+        self['Accept-Ranges'] = 'bytes'
+        if obj.status == 206:
+            self.status_code = 206
+
+        if as_attachment and filename:
+            self['Content-Disposition'] = "attachment; filename*=UTF-8''%s" % urlquote(filename)
+
+
+def _encrypted_range(storage, name, byte_range):
+    """
+    Translate a suffix range, which CryptoBucket doesn't support, into the
+    range from the start, given the size of the file.
+    """
+    if byte_range is None or byte_range[0] is not None:
+        return byte_range
+    size = storage.size(name)
+    if not size or not byte_range[1]:
+        return None
+    return max(size - byte_range[1], 0), size - 1
+
+
+def _fix_encrypted_range(response, byte_range):
+    """
+    Set the Content-Range and Content-Length of the requested range: OSS
+    answers with the range from the start of the AES block, whose first
+    bytes CryptoBucket discards.
+    """
+    match = _content_range_re.match(response.get('Content-Range', ''))
+    if match is None or byte_range is None:
+        return
+    end, total = int(match.group(2)), match.group(3)
+    response['Content-Range'] = 'bytes %d-%d/%s' % (byte_range[0], end, total)
+    response['Content-Length'] = str(end - byte_range[0] + 1)
+
+
+def _accel_redirect_response(storage, key, prefix, expires):
+    """
+    Hand the download off to nginx, with the signed url of the object after
+    the prefix of an internal location, e.g.:
+
+        location ~ ^/oss-internal/(.*?)/(.*) {
+            internal;
+            resolver 8.8.8.8;
+            proxy_pass https://$1/$2$is_args$args;
+        }
+    """
+    url = storage.bucket.sign_url('GET', key, expires=expires)
+    path, _, query = url.split('://', 1)[-1].partition('?')
+    # nginx unescapes the path of the redirect, but not its query: the path
+    # is escaped again, so that it reaches OSS as signed, with its slashes
+    # unescaped as in url()
+    path = urlquote(path.replace('%2F', '/'), safe='/')
+    response = HttpResponse()
+    # let nginx use the content type of OSS
+    del response['Content-Type']
+    response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + path + ('?' + query if query else '')
+    return response
+
+
+def serve(request, name, storage=None, accel_redirect=None, chunk_size=None, as_attachment=False):
+    """
+    Serve the file of the storage by streaming it from OSS in chunks.
+
+    The Range and conditional headers of the request are passed to OSS, so
+    206 and 304 answers don't transfer the whole object. Archived objects are
+    answered with a 503 while they are restored. With accel_redirect, or
+    OSS_ACCEL_REDIRECT_PREFIX, the download is handed to nginx instead.
+    Permissions must be checked before calling it.
+
+    Encrypted files are always streamed, since nginx would serve their
+    encrypted content.
+    """
+    storage = storage if storage is not None else default_storage
+    key = storage._get_key_name(name)
+    if storage.encrypted:
+        if accel_redirect:
+            raise ValueError("Encrypted OSS files can't be served with accel redirect")
+        accel_redirect = ''
+    elif accel_redirect is None:
+        accel_redirect = _get_config('OSS_ACCEL_REDIRECT_PREFIX', default='')
+    if accel_redirect:
+        expires = int(_get_config('OSS_ACCEL_REDIRECT_EXPIRE_TIME', default=60))
+        return _accel_redirect_response(storage, key, accel_redirect, expires)
+
+    headers = {}
+    for header in CONDITIONAL_HEADERS:
+        value = request.META.get('HTTP_' + header.upper().replace('-', '_'))
+        if value:
+            headers[header] = value
+    byte_range = _parse_range(request.META.get('HTTP_RANGE'))
+    logger().debug("serve key: %s, range: %s, headers: %s", key, byte_range, headers)
+
+    try:
+        if storage.encrypted:
+            byte_range = _encrypted_range(storage, name, byte_range)
+        obj = storage.bucket.get_object(key, byte_range=byte_range, headers=headers)
+    except oss2.exceptions.NotModified as e:
+        response = HttpResponseNotModified()
+        etag = e.headers.get('ETag') if e.headers else None
+        if etag:
+            response['ETag'] = etag
+        return response
+    except oss2.exceptions.PreconditionFailed:
+        return HttpResponse(status=412)
+    except oss2.exceptions.NotFound:
+        raise Http404("%s does not exist" % name)
+    except oss2.exceptions.ServerError as e:
+        if not is_archived_error(e):
+            raise
+        # don't hold the request while the archived object is restored
+        storage._request_restore(key)
+        response = HttpResponse("%s is being restored" % name, status=503)
+        response['Retry-After'] = _get_config('OSS_RESTORE_RETRY_AFTER', default=60)
+        return response
+
+    logger().debug("serve key: %s, status: %d, requestid: %s", key, obj.status, obj.request_id)
+    response = OssStreamingResponse(obj, chunk_size=chunk_size, as_attachment=as_attachment,
+                                    filename=os.path.basename(name))
+    if storage.encrypted and obj.status == 206:
+        _fix_encrypted_range(response, byte_range)
+    return response
+
+
+def serve_archive(request, names, filename, storage=None, format='zip', **kwargs):
+    """
+    Serve a zip or tar archive of the files of the storage, streamed while
+    they are downloaded from OSS, see OssStorage.archive. Permissions must
+    be checked before calling it.
+    """
+    storage = storage if storage is not None else default_storage
+    logger().debug("serve archive: %s, format: %s", filename, format)
+    response = StreamingHttpResponse(storage.archive(names, format=format, **kwargs),
+                                     content_type=ARCHIVE_CONTENT_TYPES[format])
+    response['Content-Disposition'] = "attachment; filename*=UTF-8''%s" % urlquote(filename)
+    return response
+
+
+class OssServeView(View):
+    """
+    Class-based view serving the file named by the name url argument.
+
+    Override has_permission() to check access to the file.
+    """
+
+    storage = None
+    accel_redirect = None
+    chunk_size = None
+    as_attachment = False
+
+    def has_permission(self, request, name):
+        return True
+
+    def get(self, request, name):
+        if not self.has_permission(request, name):
+            raise PermissionDenied
+        return serve(request, name, storage=self.storage, accel_redirect=self.accel_redirect,
+                     chunk_size=self.chunk_size, as_attachment=self.as_attachment)
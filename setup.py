@@ -26,9 +26,11 @@ setup(
     version=version,
     description='Django Aliyun OSS (Object Storage Service) storage',
     long_description=readme,
-    packages=['django_oss_storage'],
+    packages=['django_oss_storage',
+              'django_oss_storage.management',
+              'django_oss_storage.management.commands'],
     install_requires=['django>=1.10',
-                      'oss2>=2.3.3'],
+                      'oss2>=2.11.0'],
     include_package_data=True,
     url='https://www.aliyun.com/product/oss',
     classifiers=[
@@ -1,22 +1,35 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
+import time
+import shutil
+import tarfile
+import zipfile
 import logging
+import tempfile
+import subprocess
 import requests
 import oss2
+import six
 
 from datetime import timedelta
 from contextlib import contextmanager
 from logging.handlers import RotatingFileHandler
 from django.conf import settings
-from django.test import SimpleTestCase
-from django.core.exceptions import ImproperlyConfigured
+from django.test import RequestFactory, SimpleTestCase
+from django.core.exceptions import ImproperlyConfigured, SuspiciousOperation
 from django.core.files.storage import default_storage
 from django.contrib.staticfiles.storage import staticfiles_storage
 from django.utils import timezone
 from django.utils.timezone import is_naive, make_naive, utc
-from django_oss_storage.backends import OssError, OssMediaStorage, OssStaticStorage, OssStorage, _get_config
+from django_oss_storage.backends import OssError, OssMediaStorage, OssRestoreInProgress, OssStaticStorage, OssStorage, _get_config
 from django_oss_storage import defaults
+from django_oss_storage.cache import OssFileMeta
+from django_oss_storage.crypto import OssEncryptedMediaStorage
+from django_oss_storage.deferred import DeferredUploader
+from django_oss_storage.tracing import NOOP_SPAN, OssTracer
+from django_oss_storage.views import serve, serve_archive
 from oss2 import to_unicode
 from django.core.files.base import ContentFile
 
@@ -50,6 +63,17 @@ class TestOssStorage(SimpleTestCase):
         finally:
             pass
 
+    def encryption_settings(self, **kwargs):
+        """
+        Settings of the encrypted storages, with a new RSA key pair.
+        """
+        from Crypto.PublicKey import RSA
+        key = RSA.generate(2048)
+        return self.settings(OSS_CRYPTO_PROVIDER='rsa',
+                             OSS_CRYPTO_RSA_PRIVATE_KEY=key.exportKey().decode(),
+                             OSS_CRYPTO_RSA_PUBLIC_KEY=key.publickey().exportKey().decode(),
+                             **kwargs)
+
     def test_settings_mported(self):
         # Make sure bucket 'test-tmp-b1' exist under your OSS account
         #self.assertEqual(settings.OSS_BUCKET_NAME, "test-tmp-b1")
@@ -65,7 +89,38 @@ class TestOssStorage(SimpleTestCase):
         self.assertFalse(default_storage.exists("test.txt"))
         with self.save_file(name="test.txt"):
             self.assertTrue(default_storage.exists("test.txt"))
-            self.assertRaises(ValueError, lambda: default_storage.open("test.txt", "wb"))
+            self.assertRaises(ValueError, lambda: default_storage.open("test.txt", "r+b"))
+
+    def test_open_write_small(self):
+        with default_storage.open("test.txt", "wb") as handle:
+            handle.write(b"te")
+            handle.write(b"st")
+        try:
+            self.assertEqual(default_storage.open("test.txt").read(), b"test")
+        finally:
+            default_storage.delete("test.txt")
+
+    def test_open_write_multipart(self):
+        data = b"0123456789" * 30 * 1024
+        with self.settings(OSS_PART_SIZE=100 * 1024):
+            with default_storage.open("test.txt", "wb") as handle:
+                for i in range(0, len(data), 7000):
+                    handle.write(data[i:i + 7000])
+                self.assertIsNotNone(handle.file.upload_id)
+        try:
+            self.assertEqual(default_storage.open("test.txt").read(), data)
+        finally:
+            default_storage.delete("test.txt")
+
+    def test_open_write_abort(self):
+        with self.settings(OSS_PART_SIZE=100 * 1024):
+            try:
+                with default_storage.open("test.txt", "wb") as handle:
+                    handle.write(b"0" * 200 * 1024)
+                    raise RuntimeError("fail")
+            except RuntimeError:
+                pass
+        self.assertFalse(default_storage.exists("test.txt"))
 
     def test_save_and_open(self):
         with self.save_file() as name:
@@ -129,6 +184,67 @@ class TestOssStorage(SimpleTestCase):
             self.assertEqual(response.content, data)
             self.assertEqual(response.headers['Content-Type'], "text/plain")
 
+    def test_append(self):
+        self.assertFalse(default_storage.exists("test.txt"))
+        try:
+            self.assertEqual(default_storage.append("test.txt", b"te"), 2)
+            self.assertEqual(default_storage.append("test.txt", ContentFile(b"st")), 4)
+            self.assertEqual(default_storage.open("test.txt").read(), b"test")
+        finally:
+            default_storage.delete("test.txt")
+
+    def test_append_stale_position(self):
+        try:
+            default_storage.append("test.txt", b"te")
+            # another process appended in the meantime
+            other_storage = OssMediaStorage()
+            other_storage.append("test.txt", b"st")
+            self.assertEqual(default_storage.append("test.txt", b"!"), 5)
+            self.assertEqual(default_storage.open("test.txt").read(), b"test!")
+        finally:
+            default_storage.delete("test.txt")
+
+    def test_open_append_mode(self):
+        try:
+            with default_storage.open("test.txt", "ab") as handle:
+                handle.write(b"te")
+            with default_storage.open("test.txt", "ab") as handle:
+                handle.write(b"st")
+            self.assertEqual(default_storage.open("test.txt").read(), b"test")
+        finally:
+            default_storage.delete("test.txt")
+
+    def test_serve(self):
+        with self.save_file():
+            response = serve(RequestFactory().get("/"), "test.txt", chunk_size=3)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(list(response.streaming_content), [b"tes", b"t"])
+            self.assertEqual(response['Content-Length'], "4")
+            self.assertEqual(response['Content-Type'], "text/plain")
+            response.close()
+
+    def test_serve_range(self):
+        with self.save_file(content=b"0123456789"):
+            response = serve(RequestFactory().get("/", HTTP_RANGE="bytes=2-4"), "test.txt")
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(b"".join(response.streaming_content), b"234")
+            self.assertEqual(response['Content-Range'], "bytes 2-4/10")
+
+    def test_serve_not_modified(self):
+        with self.save_file():
+            etag = serve(RequestFactory().get("/"), "test.txt")['ETag']
+            response = serve(RequestFactory().get("/", HTTP_IF_NONE_MATCH=etag), "test.txt")
+            self.assertEqual(response.status_code, 304)
+
+    def test_serve_accel_redirect(self):
+        response = serve(RequestFactory().get("/"), "test.txt", accel_redirect="/oss-internal/")
+        self.assertTrue(response['X-Accel-Redirect'].startswith("/oss-internal/"))
+        self.assertIn("/media/test.txt?", response['X-Accel-Redirect'])
+
+        # unescaped once by nginx, into the path signed by OSS
+        response = serve(RequestFactory().get("/"), "folder/test?+123.txt", accel_redirect="/oss-internal/")
+        self.assertIn("/media/folder/test%253F%252B123.txt?", response['X-Accel-Redirect'])
+
     def test_exists(self):
         self.assertFalse(default_storage.exists("test.txt"))
         with self.save_file():
@@ -155,6 +271,52 @@ class TestOssStorage(SimpleTestCase):
             self.assertTrue(default_storage.exists("test"))
             self.assertTrue(default_storage.exists("test/"))
 
+    def test_shared_cache(self):
+        caches = {
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'oss': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'oss'},
+        }
+        with self.settings(CACHES=caches, OSS_CACHE_ALIAS='oss'):
+            storage = OssMediaStorage()
+            other_storage = OssMediaStorage()
+            self.assertFalse(storage.exists("test.txt"))
+            self.assertFalse(other_storage.exists("test.txt"))
+            with self.save_file(storage=storage):
+                # saving invalidates the negative answer of all the storages
+                self.assertTrue(other_storage.exists("test.txt"))
+                self.assertEqual(storage.size("test.txt"), 4)
+                self.assertEqual(other_storage.get_file_meta("test.txt").content_length, 4)
+                self.assertEqual(storage.url("test.txt"), other_storage.url("test.txt"))
+            self.assertFalse(other_storage.exists("test.txt"))
+
+            self.assertFalse(storage.exists("test/"))
+            with self.save_file(name="test/bar.txt", storage=other_storage):
+                self.assertTrue(storage.exists("test/"))
+                self.assertTrue(storage.exists("test"))
+
+    def test_prefetch(self):
+        caches = {
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'oss': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'oss-prefetch'},
+        }
+        with self.settings(CACHES=caches, OSS_CACHE_ALIAS='oss', OSS_CACHE_MAX_CONTENT_SIZE=1024):
+            storage = OssMediaStorage()
+            with self.save_file(storage=storage), self.save_file(name="test2.txt", content=b"test2", storage=storage):
+                failures = storage.prefetch(["test.txt", "test2.txt", "missing.txt"])
+                self.assertEqual(list(failures), ["missing.txt"])
+
+                cache = storage.cache
+                self.assertEqual(cache.get_meta("media/test2.txt")[1].content_length, 5)
+                self.assertIsNotNone(cache.get_url("media/test.txt")[1])
+                self.assertEqual(cache.get_content("media/test.txt")[1], b"test")
+                self.assertEqual(storage.open("test2.txt").read(), b"test2")
+
+            self.assertRaises(ValueError, storage.prefetch, ["test.txt"], what=("thumbnail",))
+
+        # nothing to fill without a cache
+        self.assertIsNone(default_storage.cache)
+        self.assertRaises(ValueError, default_storage.prefetch, ["test.txt"])
+
     def test_size(self):
         with self.save_file():
             self.assertEqual(default_storage.size("test.txt"), 4)
@@ -212,6 +374,22 @@ class TestOssStorage(SimpleTestCase):
             self.assertEqual(default_storage.listdir("test/"), ([], [u'media/test/test.txt']))
             self.assertEqual(default_storage.listdir("test/test/"), ([], []))
 
+    def test_walk(self):
+        self.assertFalse(default_storage.exists("test"))
+        with self.save_file(name="test/a.txt"), self.save_file(name="test/sub/b.txt", content=b"test2"):
+            walked = dict((dirpath, (dirs, [obj.key for obj in files]))
+                          for dirpath, dirs, files in default_storage.walk("test"))
+            self.assertEqual(walked, {
+                u'media/test/': ([u'media/test/sub/'], [u'media/test/a.txt']),
+                u'media/test/sub/': ([], [u'media/test/sub/b.txt']),
+            })
+
+    def test_du(self):
+        with self.save_file(name="test/a.txt"), self.save_file(name="test/sub/b.txt", content=b"test2"):
+            self.assertEqual(default_storage.du("test"), (9, 2))
+            self.assertEqual(default_storage.du("test/sub/"), (5, 1))
+            self.assertEqual(default_storage.du("test/missing"), (0, 0))
+
     def test_endpoint_url(self):
         with self.settings(OSS_ENDPOINT = "https://oss-cn-shanghai.aliyuncs.com"), self.save_file() as name:
             self.assertEqual(name, "test.txt")
@@ -299,6 +477,393 @@ class TestOssStorage(SimpleTestCase):
             self.assertEqual(storage_with_default_arguments.bucket_name,
                              settings.OSS_BUCKET_NAME)
 
+    def test_read_routing(self):
+        with self.settings(OSS_READ_ENDPOINTS=[settings.OSS_ENDPOINT]):
+            storage = OssMediaStorage()
+            with self.save_file(storage=storage):
+                for _ in range(3):
+                    self.assertEqual(storage.open("test.txt").read(), b"test")
+                self.assertFalse(storage.exists("missing.txt"))
+            stats = storage.routing_stats()
+            self.assertEqual(len(stats), 2)
+            self.assertTrue(all(s['healthy'] for s in stats))
+            self.assertEqual(sum(s['requests'] for s in stats), sum(s['requests'] for s in stats if s['latency'] is not None))
+        self.assertIsNone(default_storage.routing_stats())
+
+    def test_read_routing_failover(self):
+        with self.settings(OSS_READ_ENDPOINTS=["http://127.0.0.1:1"], OSS_READ_MAX_ERROR_RATE=0.1):
+            storage = OssMediaStorage()
+            with self.save_file(storage=storage):
+                self.assertEqual(storage.size("test.txt"), 4)
+                self.assertEqual(storage.size("test.txt"), 4)
+            stats = dict((s['endpoint'], s) for s in storage.routing_stats())
+            self.assertFalse(stats["http://127.0.0.1:1"]['healthy'])
+            self.assertEqual(stats["http://127.0.0.1:1"]['errors'], 1)
+
+    def test_deferred_upload(self):
+        spool_dir = tempfile.mkdtemp()
+        try:
+            with self.settings(OSS_DEFERRED_UPLOAD_DIR=spool_dir):
+                storage = OssMediaStorage()
+                name = storage.save("test.txt", ContentFile(b"test"))
+                try:
+                    self.assertEqual(name, "test.txt")
+                    # served from the spool until the upload lands
+                    self.assertTrue(storage.exists("test.txt"))
+                    self.assertEqual(storage.size("test.txt"), 4)
+                    self.assertEqual(storage.open("test.txt").read(), b"test")
+                    self.assertTrue(storage.uploader.join(timeout=30))
+                    self.assertIsNone(storage.uploader.pending_path("media/test.txt"))
+                    self.assertEqual(default_storage.open("test.txt").read(), b"test")
+                    self.assertEqual(os.listdir(storage.uploader.spool_dir), [])
+                finally:
+                    storage.delete("test.txt")
+        finally:
+            shutil.rmtree(spool_dir)
+
+    def test_deferred_upload_order(self):
+        spool_dir = tempfile.mkdtemp()
+        try:
+            with self.settings(OSS_DEFERRED_UPLOAD_DIR=spool_dir):
+                storage = OssMediaStorage()
+                try:
+                    # the last saved content lands last
+                    storage._save("test.txt", ContentFile(b"0" * 1024 * 1024))
+                    storage._save("test.txt", ContentFile(b"new"))
+                    self.assertTrue(storage.uploader.join(timeout=30))
+                    self.assertEqual(default_storage.open("test.txt").read(), b"new")
+
+                    # a running upload doesn't bring a deleted file back
+                    storage._save("test.txt", ContentFile(b"0" * 1024 * 1024))
+                    storage.delete("test.txt")
+                    self.assertTrue(storage.uploader.join(timeout=30))
+                    self.assertFalse(default_storage.exists("test.txt"))
+                finally:
+                    storage.delete("test.txt")
+        finally:
+            shutil.rmtree(spool_dir)
+
+    def test_deferred_upload_failure(self):
+        spool_dir = tempfile.mkdtemp()
+        try:
+            bucket = oss2.Bucket(default_storage.auth, settings.OSS_ENDPOINT,
+                                 "django-oss-storage-missing-bucket-%d" % int(time.time()))
+            uploader = DeferredUploader(bucket, spool_dir, workers=1, retries=0, requeue_delay=1)
+            uploader.enqueue("media/test.txt", b"test")
+            # the failed upload stays pending, and is served from the spool
+            self.assertFalse(uploader.join(timeout=3))
+            self.assertIsNotNone(uploader.pending_path("media/test.txt"))
+            uploader.cancel("media/test.txt")
+            self.assertTrue(uploader.join(timeout=5))
+            self.assertEqual(os.listdir(spool_dir), [])
+        finally:
+            shutil.rmtree(spool_dir)
+
+    def test_read_range(self):
+        with self.save_file(content=b"0123456789"):
+            self.assertEqual(default_storage.read_range("test.txt", 2, 4), b"234")
+            self.assertEqual(default_storage.read_range("test.txt", 7), b"789")
+        self.assertRaises(OssError, default_storage.read_range, "test.txt", 0, 1)
+
+    def test_encrypted_storage(self):
+        with self.encryption_settings():
+            storage = OssEncryptedMediaStorage()
+            data = b"0123456789" * 1000
+            with self.save_file(content=data, storage=storage) as name:
+                self.assertEqual(storage.open(name).read(), data)
+                self.assertNotEqual(default_storage.open(name).read(), data)
+                self.assertEqual(storage.read_range(name, 4321, 4330), data[4321:4331])
+                self.assertEqual(storage.open(name).read(), data)
+            self.assertRaises(ValueError, storage.open, "test.txt", "wb")
+
+    def test_serve_encrypted(self):
+        with self.encryption_settings(OSS_CACHE_ALIAS='default', OSS_CACHE_MAX_CONTENT_SIZE=1024):
+            storage = OssEncryptedMediaStorage()
+            data = b"0123456789" * 10
+            with self.save_file(content=data, storage=storage) as name:
+                response = serve(RequestFactory().get("/", HTTP_RANGE="bytes=5-10"), name, storage=storage)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(b"".join(response.streaming_content), data[5:11])
+                self.assertEqual(response['Content-Range'], "bytes 5-10/100")
+                self.assertEqual(response['Content-Length'], "6")
+
+                response = serve(RequestFactory().get("/", HTTP_RANGE="bytes=-4"), name, storage=storage)
+                self.assertEqual(b"".join(response.streaming_content), data[-4:])
+                self.assertEqual(response['Content-Range'], "bytes 96-99/100")
+
+                with self.assertRaises(ValueError):
+                    serve(RequestFactory().get("/"), name, storage=storage, accel_redirect="/oss-internal/")
+
+                # the plain text isn't cached, nor shared with the plain storages
+                self.assertEqual(storage.cache.max_content_size, 0)
+                self.assertEqual(storage.open(name).read(), data)
+                self.assertNotEqual(OssMediaStorage().open(name).read(), data)
+
+    def test_snapshot(self):
+        snapshot_dir = tempfile.mkdtemp()
+        try:
+            with self.settings(OSS_SNAPSHOT_PATH=os.path.join(snapshot_dir, 'snapshot.db'), OSS_SNAPSHOT_PREFIX='test/'):
+                storage = OssMediaStorage()
+                with self.save_file(name="test/a.txt"), self.save_file(name="test/sub/b.txt", content=b"test2"):
+                    self.assertEqual(storage.snapshot.build(storage), 2)
+                    with self.save_file(name="test/sub/c.txt"):
+                        # not in the snapshot, and not looked up in OSS
+                        self.assertFalse(storage.exists("test/sub/c.txt"))
+                        self.assertEqual(storage.snapshot.refresh(storage), 1)
+                        self.assertTrue(storage.exists("test/sub/c.txt"))
+                    self.assertTrue(storage.exists("test/sub/b.txt"))
+                    self.assertTrue(storage.exists("test/sub"))
+                    self.assertEqual(storage.size("test/sub/b.txt"), 5)
+                    self.assertEqual(storage.listdir("test"), ([u'media/test/sub/'], [u'media/test/a.txt']))
+
+                    # writes of the process are seen at once
+                    with self.save_file(name="test/d.txt", storage=storage):
+                        self.assertTrue(storage.exists("test/d.txt"))
+                        self.assertEqual(storage.size("test/d.txt"), 4)
+                    self.assertFalse(storage.exists("test/d.txt"))
+
+                with self.settings(OSS_SNAPSHOT_MAX_AGE=1):
+                    storage = OssMediaStorage()
+                    time.sleep(2)
+                    self.assertFalse(storage.exists("test/a.txt"))
+        finally:
+            shutil.rmtree(snapshot_dir)
+
+    def test_transfer_limits(self):
+        limits = {'OssMediaStorage': {'bandwidth': 64 * 1024, 'concurrency': 2}}
+        with self.settings(OSS_TRANSFER_LIMITS=limits):
+            storage = OssMediaStorage()
+            self.assertIsNone(staticfiles_storage.transfer_stats())
+            data = b"0" * 128 * 1024
+            start = time.time()
+            with self.save_file(content=data, storage=storage):
+                self.assertEqual(storage.open("test.txt").read(), data)
+            # 256KB at 64KB/s, with a burst of 64KB
+            self.assertGreater(time.time() - start, 2.5)
+            stats = storage.transfer_stats()
+            self.assertEqual(stats['bytes'], 256 * 1024)
+            self.assertEqual(stats['active'], 0)
+            self.assertEqual(stats['waiting'], 0)
+            self.assertEqual(stats['concurrency'], 2)
+
+    def test_json_config(self):
+        os.environ['OSS_TRANSFER_LIMITS'] = '{"OssMediaStorage": {"concurrency": 3}}'
+        os.environ['OSS_STORAGE_CLASS_POLICIES'] = '{"media/archive/": "Archive"}'
+        try:
+            storage = OssMediaStorage()
+            self.assertEqual(storage.transfer_stats()['concurrency'], 3)
+            self.assertEqual(storage.storage_class_policies.storage_class("media/archive/a.txt"), 'Archive')
+            os.environ['OSS_TRANSFER_LIMITS'] = '{'
+            self.assertRaises(ImproperlyConfigured, OssMediaStorage)
+        finally:
+            del os.environ['OSS_TRANSFER_LIMITS']
+            del os.environ['OSS_STORAGE_CLASS_POLICIES']
+
+    def test_connection_pool(self):
+        with self.settings(OSS_CONNECTION_POOL_SIZE=7):
+            storage = OssMediaStorage()
+            other_storage = OssStaticStorage()
+            self.assertIs(storage.session, other_storage.session)
+            self.assertIs(storage.bucket.session, storage.session)
+            self.assertIsNot(storage.session, default_storage.session)
+
+            storage.warm_up(3)
+            stats = storage.pool_stats()
+            self.assertEqual(len(stats), 1)
+            self.assertEqual(stats[0]['size'], 7)
+            # open connections only, not the free slots of the pool
+            self.assertGreaterEqual(stats[0]['idle'], 3)
+            self.assertLessEqual(stats[0]['idle'], stats[0]['misses'])
+            misses = stats[0]['misses']
+
+            # served by the warm connections
+            with self.save_file(storage=storage):
+                storage.size("test.txt")
+            stats = storage.pool_stats()
+            self.assertEqual(stats[0]['misses'], misses)
+            self.assertGreater(stats[0]['hits'], 0)
+
+    def test_lazy_connect(self):
+        # nothing is requested until the first operation
+        storage = OssStorage(bucket_name="django-oss-storage-missing-bucket-%d" % int(time.time()))
+        self.assertIsNone(storage._bucket)
+        with self.assertRaises(SuspiciousOperation):
+            storage.bucket
+        self.assertIsNone(storage._bucket)
+
+        storage = OssMediaStorage()
+        self.assertIsNone(storage._session)
+        self.assertEqual(storage.bucket_acl, default_storage.bucket_acl)
+        self.assertIs(storage.session, default_storage.session)
+
+    def test_lazy_import(self):
+        code = "import sys, django_oss_storage.backends, django_oss_storage.views; print('oss2' in sys.modules)"
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        output = subprocess.check_output([sys.executable, '-c', code], env=env)
+        self.assertEqual(output.decode().strip(), 'False')
+
+    def test_tracing(self):
+        self.assertIs(default_storage.tracer.span('open', key="test.txt"), NOOP_SPAN)
+        try:
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+            from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+        except ImportError:
+            self.skipTest("opentelemetry-sdk is not installed")
+
+        exporter = InMemorySpanExporter()
+        provider = TracerProvider()
+        provider.add_span_processor(SimpleSpanProcessor(exporter))
+        storage = OssMediaStorage()
+        storage.tracer = OssTracer(1, tracer_provider=provider)
+        with self.settings(OSS_PART_SIZE=100 * 1024):
+            with storage.open("test.bin", "wb") as handle:
+                handle.write(b"0123456789" * 30 * 1024)
+        storage.delete("test.bin")
+        with self.save_file(storage=storage):
+            storage.open("test.txt").read()
+            self.assertGreaterEqual(storage.du("")[1], 1)
+        with self.assertRaises(OssError):
+            storage.open("missing.txt")
+
+        spans = dict((span.name, span) for span in exporter.get_finished_spans())
+        self.assertEqual(spans['oss.write'].attributes['oss.parts'], 3)
+        self.assertEqual(spans['oss.upload_part'].attributes['oss.key'], "media/test.bin")
+        self.assertEqual(spans['oss.walk'].parent.span_id, spans['oss.du'].context.span_id)
+        self.assertEqual(spans['oss.save'].attributes['oss.key'], "media/test.txt")
+        self.assertTrue(spans['oss.save'].attributes['oss.request_id'])
+        self.assertEqual(spans['oss.delete'].attributes['oss.key'], "media/test.txt")
+        # the failed request of the last open
+        self.assertEqual(spans['oss.open'].attributes['oss.key'], "media/missing.txt")
+        self.assertTrue(spans['oss.open'].attributes['oss.request_id'])
+        self.assertFalse(spans['oss.open'].status.is_ok)
+
+    def test_archive(self):
+        data = b"0123456789" * 100 * 1024
+        with self.save_file("a.txt", content=data):
+            with self.save_file("b/c.txt"):
+                archive = zipfile.ZipFile(six.BytesIO(b"".join(default_storage.archive(["a.txt", ("b/c.txt", "c.txt")],
+                                                                                       read_ahead=64 * 1024))))
+                self.assertEqual(archive.namelist(), ["a.txt", "c.txt"])
+                self.assertEqual(archive.read("a.txt"), data)
+                self.assertEqual(archive.read("c.txt"), b"test")
+
+                response = serve_archive(RequestFactory().get('/'), ["a.txt", "b/c.txt"], "files.tar", format='tar')
+                self.assertEqual(response['Content-Type'], 'application/x-tar')
+                archive = tarfile.open(fileobj=six.BytesIO(b"".join(response.streaming_content)))
+                self.assertEqual(archive.getnames(), ["a.txt", "b/c.txt"])
+                self.assertEqual(archive.extractfile("a.txt").read(), data)
+
+                try:
+                    default_storage.save_archive("files.tar", ["a.txt", "b/c.txt"], format='tar')
+                    archive = tarfile.open(fileobj=default_storage.open("files.tar"))
+                    self.assertEqual(archive.extractfile("b/c.txt").read(), b"test")
+                finally:
+                    default_storage.delete("files.tar")
+
+                with self.assertRaises(oss2.exceptions.NoSuchKey):
+                    list(default_storage.archive(["a.txt", "missing.txt"]))
+
+    def test_save_archive_limits(self):
+        # the downloads and the upload of the parts share a single slot
+        limits = {'OssMediaStorage': {'concurrency': 1}}
+        data = b"0123456789" * 200 * 1024
+        with self.settings(OSS_TRANSFER_LIMITS=limits, OSS_PART_SIZE=100 * 1024):
+            storage = OssMediaStorage()
+            with self.save_file("a.txt", content=data, storage=storage):
+                with self.save_file("b.txt", storage=storage):
+                    try:
+                        storage.save_archive("files.zip", ["a.txt", "b.txt"], workers=2, read_ahead=256 * 1024)
+                        archive = zipfile.ZipFile(six.BytesIO(storage.open("files.zip").read()))
+                        self.assertEqual(archive.read("a.txt"), data)
+                        self.assertEqual(archive.read("b.txt"), b"test")
+                    finally:
+                        storage.delete("files.zip")
+
+    def test_storage_class(self):
+        policies = {'media/': 'IA', 'media/archive/': 'Archive'}
+        with self.settings(OSS_STORAGE_CLASS_POLICIES=policies):
+            storage = OssMediaStorage()
+            with self.save_file("test.txt", storage=storage):
+                self.assertEqual(storage.restore_status("test.txt"), ('IA', 'readable', None))
+                self.assertEqual(storage.open("test.txt").read(), b"test")
+
+            with self.save_file("archive/test.txt", storage=storage):
+                self.assertEqual(storage.restore_status("archive/test.txt").state, 'archived')
+                with self.assertRaises(OssRestoreInProgress):
+                    storage.open("archive/test.txt")
+                self.assertEqual(storage.restore_status("archive/test.txt").state, 'restoring')
+
+                statuses, failures = storage.restore(["archive/test.txt", "missing.txt"])
+                self.assertEqual(statuses["archive/test.txt"].state, 'restoring')
+                self.assertIsInstance(failures["missing.txt"], oss2.exceptions.NotFound)
+
+    def test_verify_crc(self):
+        data = b"0123456789" * 30 * 1024
+        with self.settings(OSS_VERIFY_CRC=True, OSS_PART_SIZE=100 * 1024):
+            storage = OssMediaStorage()
+            self.assertTrue(storage.verify_crc)
+            with storage.open("test.txt", "wb") as handle:
+                handle.write(data)
+            try:
+                self.assertEqual(storage.open("test.txt").read(), data)
+            finally:
+                storage.delete("test.txt")
+
+            try:
+                storage.append("test.txt", b"te")
+                storage.append("test.txt", b"st")
+                self.assertEqual(storage._get_append_position("media/test.txt")[0], 4)
+                self.assertIsNotNone(storage._get_append_position("media/test.txt")[1])
+            finally:
+                storage.delete("test.txt")
+
+    def test_get_file_meta(self):
+        with self.save_file():
+            file_meta = default_storage.get_file_meta("test.txt")
+            self.assertIsInstance(file_meta, OssFileMeta)
+            self.assertEqual(file_meta.content_length, 4)
+            self.assertTrue(file_meta.etag)
+
+    def test_verify(self):
+        local_root = tempfile.mkdtemp()
+        try:
+            for name, content in (("a.txt", b"test"), ("sub/b.txt", b"test2"), ("c.txt", b"test3")):
+                path = os.path.join(local_root, name)
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                with open(path, 'wb') as f:
+                    f.write(content)
+
+            with self.save_file(name="test/a.txt"), self.save_file(name="test/sub/b.txt", content=b"tesT2"), \
+                    self.save_file(name="test/d.txt"):
+                default_storage.append("test/c.txt", b"test3")
+                try:
+                    self.assertEqual(default_storage.verify(local_root, "test", spot_checks=2), [
+                        ("d.txt", "missing locally"),
+                        ("sub/b.txt", "md5 differs"),
+                    ])
+                    with open(os.path.join(local_root, "c.txt"), 'wb') as f:
+                        f.write(b"tesT3")
+                    self.assertEqual(default_storage.verify(local_root, "test/")[0], ("c.txt", "crc64 differs"))
+                finally:
+                    default_storage.delete("test/c.txt")
+        finally:
+            shutil.rmtree(local_root)
+
+    def test_verify_encrypted(self):
+        local_root = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(local_root, "a.txt"), 'wb') as f:
+                f.write(b"0123456789" * 100)
+            with self.encryption_settings():
+                storage = OssEncryptedMediaStorage()
+                with self.save_file(name="test/a.txt", content=b"0123456789" * 100, storage=storage):
+                    self.assertEqual(storage.verify(local_root, "test", spot_checks=2, spot_size=100), [])
+                    self.assertRaises(ValueError, storage.verify, local_root, "test")
+        finally:
+            shutil.rmtree(local_root)
+
     def test_get_config(self):
         self.assertEqual(_get_config('OSS_ACCESS_KEY_ID'), settings.OSS_ACCESS_KEY_ID)
         self.assertRaises(ImproperlyConfigured, _get_config, "INVALID_ENV_VARIABLE_NAME")